@@ -0,0 +1,39 @@
+import sys
+import argparse
+from rollups import build_rollup, ActivityCube, GRANULARITIES, DIMENSIONS
+from metrics import add_metrics_args, instrument
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a time-bucketed activity cube (day/week/month x author/subreddit) and query it without rescanning the data.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Aggregate the comments and submissions of a folder into <folder>_rollup.npz")
+    build_parser.add_argument("folder", type=str, help="Path to the input folder")
+    build_parser.add_argument("--chunk_size", type=int, default=1000000, help="Number of records aggregated at a time (default: 1000000)")
+    build_parser.add_argument("--parquet", action="store_true", help="Read the <folder>_comments.parquet and <folder>_submissions.parquet datasets instead of the JSONL files")
+    add_metrics_args(build_parser)
+
+    query_parser = subparsers.add_parser("query", help="Comments, posts and scores per time bucket")
+    query_parser.add_argument("folder", type=str, help="Folder holding <folder>_rollup.npz")
+    query_parser.add_argument("--granularity", choices=GRANULARITIES, default="month", help="Time bucket (default: month)")
+    query_parser.add_argument("--by", choices=DIMENSIONS + ["total"], default="total", help="Break down by author or subreddit, or sum everything (default: total)")
+    query_parser.add_argument("--keys", nargs="+", default=None, help="Only these authors or subreddits")
+    query_parser.add_argument("--start", type=str, default=None, help="First bucket, e.g. 2020-01 or 2020-01-15")
+    query_parser.add_argument("--end", type=str, default=None, help="Last bucket, e.g. 2020-12")
+    query_parser.add_argument("--output", type=str, default=None, help="Write the result to this TSV file instead of stdout")
+
+    args = parser.parse_args()
+    folder = args.folder
+    cube_file = f"{folder}/{folder}_rollup.npz"
+    if args.command == "build":
+        extension = "parquet" if args.parquet else "jsonl"
+        with instrument("activity-rollup", args.metrics, args.profile):
+            sizes = build_rollup(f"{folder}/{folder}_comments.{extension}", f"{folder}/{folder}_submissions.{extension}", cube_file, args.chunk_size, args.parquet)
+        print(f"Rollup cube of {sizes['author']} authors and {sizes['subreddit']} subreddits saved to {cube_file}")
+    else:
+        cube = ActivityCube(cube_file)
+        if args.by == "total":
+            result = cube.totals(args.granularity, args.start, args.end)
+        else:
+            result = cube.query(args.granularity, args.by, args.keys, args.start, args.end)
+        result.to_csv(args.output or sys.stdout, sep='\t', index=False)
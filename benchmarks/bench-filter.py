@@ -0,0 +1,57 @@
+import os
+import time
+import argparse
+import tempfile
+from bench_utils import load_script
+from synthetic import generate
+
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def compare_outputs(reference_file, candidate_file):
+    # Count the lines that differ byte for byte between the two outputs
+    with open(reference_file, 'rb') as reference, open(candidate_file, 'rb') as candidate:
+        reference_lines = reference.readlines()
+        candidate_lines = candidate.readlines()
+    mismatches = sum(1 for a, b in zip(reference_lines, candidate_lines) if a != b)
+    mismatches += abs(len(reference_lines) - len(candidate_lines))
+    return len(reference_lines), mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the line-level projector against the pandas chunk path.")
+    parser.add_argument("input_json", nargs="?", default=None, help="Input json lines file, e.g. a sample of a raw dump (default: 10,000 synthetic records of --kind)")
+    parser.add_argument("--kind", choices=["comments", "submissions"], default="comments", help="Which keep-list to project onto")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per engine (best is reported)")
+    args = parser.parse_args()
+
+    if args.kind == "comments":
+        script = load_script("comment-filter-fields-chunk.py")
+    else:
+        script = load_script("submission-filter-chunk.py")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.input_json is None:
+            comments_dump, submissions_dump = generate(tmp, "synthetic", 10000, 1000)
+            args.input_json = comments_dump if args.kind == "comments" else submissions_dump
+        size = os.path.getsize(args.input_json)
+        pandas_out = os.path.join(tmp, "pandas.jsonl")
+        projector_out = os.path.join(tmp, "projector.jsonl")
+
+        pandas_time = min(time_call(script.convert_json_to_jsonl_pandas, args.input_json, pandas_out) for _ in range(args.repeat))
+        projector_time = min(time_call(script.convert_json_to_jsonl, args.input_json, projector_out) for _ in range(args.repeat))
+        total_lines, mismatches = compare_outputs(pandas_out, projector_out)
+
+    print(f"Input: {args.input_json} ({total_lines} lines, {size / 2 ** 20:.1f} MiB)")
+    print(f"pandas:    {pandas_time:.3f}s ({total_lines / pandas_time:,.0f} lines/s)")
+    print(f"projector: {projector_time:.3f}s ({total_lines / projector_time:,.0f} lines/s)")
+    print(f"Speedup:   {pandas_time / projector_time:.1f}x")
+    print(f"Lines differing from the pandas output: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+from bench_utils import REPO_ROOT, load_script
+
+run_batch = load_script("run-batch.py")
+
+STAGE_NAMES = run_batch.STAGE_NAMES + ["user-summary", "user-summary-db"]
+
+
+def build_stages(theme):
+    # run-batch.py's stages plus the two user-summary variants: name -> (script args, inputs, output globs)
+    stages = {name: (args, inputs, outputs) for name, (args, inputs, outputs, _) in run_batch.build_stages(theme, False).items()}
+    stages["user-summary"] = (["user-summary.py", theme], [f"{theme}/{theme}_comments.jsonl", f"{theme}/{theme}_submissions.jsonl"], [f"{theme}/user_summary_*.tsv"])
+    stages["user-summary-db"] = (["user-summary-db.py", theme], [f"{theme}/{theme}_comments.db", f"{theme}/{theme}_submissions.db"], [f"{theme}/user_summary_*.tsv"])
+    return stages
+
+
+def count_lines(path):
+    with open(path, 'rb') as file:
+        return sum(1 for _ in file)
+
+
+def run_stage(work_dir, args, log_path):
+    """Run one stage script; returns (exit code, seconds, peak RSS bytes, disk read bytes, disk write bytes)."""
+    start = time.perf_counter()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, args[0])] + args[1:], cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 gives the resource usage of this child (and the children it reaped) only
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KiB, ru_inblock / ru_oublock in 512-byte blocks on Linux
+    return process.returncode, elapsed, usage.ru_maxrss * 1024, usage.ru_inblock * 512, usage.ru_oublock * 512
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def library_versions():
+    versions = {}
+    for name in ("pandas", "numpy", "orjson", "pyarrow", "zstandard"):
+        try:
+            versions[name] = __import__(name).__version__
+        except (ImportError, AttributeError):
+            versions[name] = None
+    return versions
+
+
+def run_benchmark(work_dir, theme, stage_names):
+    results = {}
+    stages = build_stages(theme)
+    for name in stage_names:
+        args, inputs, outputs = stages[name]
+        input_paths = [os.path.join(work_dir, path) for path in inputs]
+        input_bytes = sum(os.path.getsize(path) for path in input_paths if os.path.isfile(path))
+        # Records (lines) of the stage's main input; the databases are counted through their source files
+        rows_source = input_paths[0][:-len(".db")] + ".jsonl" if input_paths[0].endswith(".db") else input_paths[0]
+        rows = count_lines(rows_source) if os.path.isfile(rows_source) else 0
+
+        returncode, elapsed, peak_rss, read_bytes, write_bytes = run_stage(work_dir, args, os.path.join(work_dir, theme, f"{theme}_{name}.log"))
+        output_bytes = sum(os.path.getsize(path) for pattern in outputs for path in glob.glob(os.path.join(work_dir, pattern)) if os.path.isfile(path))
+        results[name] = {
+            "status": "ok" if returncode == 0 else "failed",
+            "seconds": round(elapsed, 3),
+            "rows": rows,
+            "rows_per_s": round(rows / elapsed, 1),
+            "input_bytes": input_bytes,
+            "output_bytes": output_bytes,
+            "mb_per_s": round(input_bytes / 2 ** 20 / elapsed, 2),
+            "peak_rss_bytes": peak_rss,
+            "disk_read_bytes": read_bytes,
+            "disk_write_bytes": write_bytes,
+        }
+        print(f"{name:<20} {results[name]['status']:<7} {elapsed:8.2f}s {results[name]['rows_per_s']:>12,.0f} rows/s "
+              f"{results[name]['mb_per_s']:>8.1f} MiB/s {peak_rss / 2 ** 20:>8.1f} MiB RSS", flush=True)
+    return results
+
+
+def read_history(history_file):
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def compare_with_previous(history, run):
+    # Previous run on the same dataset size, for a quick regression check
+    previous = next((entry for entry in reversed(history) if entry["dataset"] == run["dataset"]), None)
+    if previous is None:
+        return
+    print(f"\nCompared with the run of {previous['timestamp']} ({previous.get('revision')}):")
+    for name, result in run["stages"].items():
+        before = previous["stages"].get(name)
+        if before and before["seconds"] > 0:
+            print(f"{name:<20} {result['seconds'] / before['seconds']:6.2f}x time  {result['peak_rss_bytes'] / max(before['peak_rss_bytes'], 1):6.2f}x RSS")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every pipeline stage on a synthetic Pushshift-shaped dataset and record the results in a JSON history.")
+    parser.add_argument("--comments", type=int, default=100000, help="Number of synthetic comments (default: 100000)")
+    parser.add_argument("--submissions", type=int, default=10000, help="Number of synthetic submissions (default: 10000)")
+    parser.add_argument("--authors", type=int, default=None, help="Number of distinct authors (default: one per 20 records)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generator (default: 0)")
+    parser.add_argument("--stages", nargs="+", choices=STAGE_NAMES, default=STAGE_NAMES, help="Stages to time, in pipeline order; a stage needs the outputs of the stages it depends on, except the filters whose outputs are generated (default: all)")
+    parser.add_argument("--work_dir", type=str, default=None, help="Where to generate the data (default: a temporary directory, removed afterwards)")
+    parser.add_argument("--history", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_history.json"), help="JSON history file the run is appended to")
+    parser.add_argument("--label", type=str, default=None, help="Free-form note stored with the run, e.g. 'pandas 2.2'")
+    args = parser.parse_args()
+
+    theme = "synthetic"
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="bench-pipeline-")
+    try:
+        start = time.perf_counter()
+        stage_names = [name for name in STAGE_NAMES if name in args.stages]
+        # Generated in a child process: Linux carries the peak RSS of this process over to the stages it starts
+        generate_args = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "generate-data.py"), work_dir, "--theme", theme,
+                         "--comments", str(args.comments), "--submissions", str(args.submissions), "--seed", str(args.seed)]
+        generate_args += ["--authors", str(args.authors)] if args.authors else []
+        generate_args += [] if {"filter-comments", "filter-submissions"} <= set(stage_names) else ["--cleaned"]
+        subprocess.run(generate_args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        print(f"Generated {args.comments} comments and {args.submissions} submissions in {time.perf_counter() - start:.1f}s under {work_dir}")
+
+        run = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": git_revision(),
+            "label": args.label,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "libraries": library_versions(),
+            "dataset": {"comments": args.comments, "submissions": args.submissions, "authors": args.authors, "seed": args.seed},
+            "stages": run_benchmark(work_dir, theme, stage_names),
+        }
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    history = read_history(args.history)
+    compare_with_previous(history, run)
+    history.append(run)
+    with open(args.history, 'w', encoding='utf-8') as file:
+        json.dump(history, file, indent=2)
+    print(f"\nResults appended to {args.history}")
+    if any(result["status"] == "failed" for result in run["stages"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import os
+import sys
+import importlib.util
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def load_script(filename):
+    # The pipeline scripts have dashes in their names, so they can't be imported directly
+    spec = importlib.util.spec_from_file_location(filename.replace('-', '_')[:-3], os.path.join(REPO_ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,21 @@
+import time
+import argparse
+from synthetic import generate, write_cleaned
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic Pushshift-shaped raw comments and submissions dumps, optionally with their cleaned .jsonl.")
+    parser.add_argument("folder", type=str, help="Output directory; the data goes to <folder>/<theme>/")
+    parser.add_argument("--theme", type=str, default="synthetic", help="Subreddit name used for the files (default: synthetic)")
+    parser.add_argument("--comments", type=int, default=100000, help="Number of comments (default: 100000)")
+    parser.add_argument("--submissions", type=int, default=10000, help="Number of submissions (default: 10000)")
+    parser.add_argument("--authors", type=int, default=None, help="Number of distinct authors (default: one per 20 records)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument("--cleaned", action="store_true", help="Also write <theme>_comments.jsonl and <theme>_submissions.jsonl with the filter scripts' fields")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    comments_path, submissions_path = generate(args.folder, args.theme, args.comments, args.submissions, args.authors, args.seed)
+    print(f"Raw dumps saved at: {comments_path}, {submissions_path} ({time.perf_counter() - start:.1f}s)")
+    if args.cleaned:
+        write_cleaned(comments_path, submissions_path)
+        print(f"Cleaned files saved at: {comments_path}.jsonl, {submissions_path}.jsonl")
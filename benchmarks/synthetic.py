@@ -0,0 +1,130 @@
+import os
+import json
+import random
+import numpy as np
+from bench_utils import load_script
+from stream_utils import filter_fields, iter_lines
+
+# Raw Pushshift objects carry many more keys than the filter scripts keep; these pad the
+# generated records to a realistic width (about 70 keys for comments, 100 for submissions)
+COMMENT_EXTRA_KEYS = [
+    "all_awardings", "associated_award", "author_flair_background_color", "author_flair_css_class",
+    "author_flair_richtext", "author_flair_template_id", "author_flair_text_color", "author_flair_type",
+    "author_fullname", "author_patreon_flair", "author_premium", "awarders", "can_gild", "collapsed",
+    "collapsed_because_crowd_control", "collapsed_reason", "comment_type", "gilded", "gildings",
+    "is_submitter", "locked", "no_follow", "permalink", "send_replies", "stickied", "subreddit_name_prefixed",
+    "subreddit_type", "top_awarded_type", "total_awards_received", "treatment_tags", "score_hidden",
+    "archived", "name", "unrepliable_reason", "author_cakeday", "distinguished", "mod_note", "mod_reason_by",
+    "mod_reason_title", "approved_at_utc", "banned_at_utc", "likes", "saved", "report_reasons",
+    "user_reports", "mod_reports", "num_reports", "removal_reason", "body_html", "created", "depth",
+    "edited_at", "ignore_reports", "quarantine", "retrieved_utc",
+]
+SUBMISSION_EXTRA_KEYS = COMMENT_EXTRA_KEYS + [
+    "allow_live_comments", "contest_mode", "crosspost_parent_list", "discussion_type", "full_link",
+    "hidden", "hide_score", "is_created_from_ads_ui", "is_crosspostable", "is_meta", "is_original_content",
+    "is_reddit_media_domain", "is_robot_indexable", "is_video", "link_flair_background_color",
+    "link_flair_css_class", "link_flair_richtext", "link_flair_template_id", "link_flair_text",
+    "link_flair_text_color", "link_flair_type", "media_embed", "media_only", "num_crossposts", "parent_whitelist_status",
+    "pinned", "post_hint", "preview", "pwls", "secure_media", "secure_media_embed", "spoiler", "suggested_sort",
+    "thumbnail", "thumbnail_height", "thumbnail_width", "upvote_ratio", "whitelist_status", "wls",
+]
+
+WORDS = ("the a i you it is that to of and in not this my food rice soup noodles pizza tofu spicy sauce "
+         "recipe chicken pork dumplings wok restaurant think really just opinion people unpopular actually "
+         "good bad better never always why because but would like love hate").split()
+START_UTC = 1420070400  # 2015-01-01
+SPAN_SECONDS = 5 * 365 * 86400
+
+
+def _text(prng, mean_words):
+    return " ".join(prng.choices(WORDS, k=max(1, int(prng.expovariate(1 / mean_words)))))
+
+
+def _skewed(rng, size, population, exponent):
+    # Zipf-distributed indexes in [0, population): a few very active authors / very popular posts
+    return (rng.zipf(exponent, size=size) - 1) % population
+
+
+def _pad(record, keys, prng):
+    # Fill the keys the pipeline doesn't use, without touching the ones it does
+    for key in keys:
+        if key not in record:
+            record[key] = None if prng.random() < 0.5 else []
+
+
+def generate(folder, theme, num_comments, num_submissions, num_authors=None, seed=0, deleted_fraction=0.1):
+    """Write Pushshift-shaped <theme>_submissions and <theme>_comments raw dumps under folder/theme.
+
+    Author activity and post popularity are Zipf-skewed, comments reply to the post or to an earlier
+    comment of the same post, and some records use the older key formats (edited, missing ups/downs).
+    Returns the paths of the two dumps.
+    """
+    rng = np.random.default_rng(seed)  # bulk draws
+    prng = random.Random(seed)  # per-record draws, much cheaper one at a time
+    num_authors = num_authors or max(10, (num_comments + num_submissions) // 20)
+    os.makedirs(os.path.join(folder, theme), exist_ok=True)
+    submissions_path = os.path.join(folder, theme, f"{theme}_submissions")
+    comments_path = os.path.join(folder, theme, f"{theme}_comments")
+
+    def author_name(index):
+        return "[deleted]" if prng.random() < deleted_fraction else f"user_{index}"
+
+    post_ids = np.arange(num_submissions) + 36 ** 4  # five-character base-36 ids like real ones
+    post_times = np.sort(rng.integers(START_UTC, START_UTC + SPAN_SECONDS, size=num_submissions))
+    with open(submissions_path, 'w', encoding='utf-8') as out_file:
+        authors = _skewed(rng, num_submissions, num_authors, 1.5)
+        scores = np.minimum(rng.zipf(1.8, size=num_submissions), 100000)
+        for i in range(num_submissions):
+            post_id = np.base_repr(post_ids[i], 36).lower()
+            is_self = bool(prng.random() < 0.7)
+            post = {
+                "id": post_id, "author": author_name(authors[i]), "subreddit": theme, "subreddit_id": "t5_2qh1i",
+                "title": _text(prng, 10), "selftext": _text(prng, 60) if is_self else "",
+                "url": f"https://www.reddit.com/r/{theme}/comments/{post_id}/" if is_self else "https://i.imgur.com/x.jpg",
+                "permalink": f"/r/{theme}/comments/{post_id}/", "created_utc": int(post_times[i]),
+                "score": int(scores[i]), "num_comments": 0, "author_flair_text": None, "is_self": is_self,
+                "domain": f"self.{theme}" if is_self else "i.imgur.com", "over_18": bool(prng.random() < 0.02),
+                "media": None if is_self else {"type": "imgur.com"}, "stickied": False, "distinguished": None,
+                "retrieved_on": int(post_times[i]) + 86400,
+                # Older dumps: edited is a boolean, ups/downs are present
+                "edited": False if prng.random() < 0.9 else int(post_times[i]) + 600,
+            }
+            if prng.random() < 0.3:
+                post["ups"], post["downs"] = post["score"], 0
+            _pad(post, SUBMISSION_EXTRA_KEYS, prng)
+            out_file.write(json.dumps(post) + "\n")
+
+    with open(comments_path, 'w', encoding='utf-8') as out_file:
+        authors = _skewed(rng, num_comments, num_authors, 1.3)
+        posts = _skewed(rng, num_comments, num_submissions, 1.2)
+        comment_times = np.sort(rng.integers(START_UTC, START_UTC + SPAN_SECONDS, size=num_comments))
+        scores = np.minimum(rng.zipf(2.0, size=num_comments), 100000)
+        last_comment = {}  # post -> id of its latest comment, to reply to
+        for i in range(num_comments):
+            comment_id = np.base_repr(36 ** 5 + i, 36).lower()
+            post = posts[i]
+            link_id = f"t3_{np.base_repr(post_ids[post], 36).lower()}"
+            parent_id = f"t1_{last_comment[post]}" if post in last_comment and prng.random() < 0.6 else link_id
+            last_comment[post] = comment_id
+            created_utc = int(max(comment_times[i], post_times[post]))
+            comment = {
+                "id": comment_id, "author": author_name(authors[i]), "subreddit": theme, "subreddit_id": "t5_2qh1i",
+                "link_id": link_id, "parent_id": parent_id, "score": int(scores[i]) - int(prng.random() < 0.1) * 5,
+                "created_utc": created_utc, "body": _text(prng, 25), "author_flair_text": None,
+                "controversiality": int(prng.random() < 0.05), "retrieved_on": created_utc + 86400,
+                "edited": False if prng.random() < 0.95 else created_utc + 300,
+            }
+            if prng.random() < 0.3:
+                comment["ups"], comment["downs"] = comment["score"], 0
+            _pad(comment, COMMENT_EXTRA_KEYS, prng)
+            out_file.write(json.dumps(comment) + "\n")
+
+    return comments_path, submissions_path
+
+
+def write_cleaned(comments_path, submissions_path):
+    """Project the raw dumps onto the filter scripts' fields, as <dump>.jsonl."""
+    comments_fields = load_script("comment-filter-fields-chunk.py").comments_fields_to_keep
+    submission_fields = load_script("submission-filter-chunk.py").submission_fields_to_keep
+    filter_fields(iter_lines(comments_path), f"{comments_path}.jsonl", comments_fields)
+    filter_fields(iter_lines(submissions_path), f"{submissions_path}.jsonl", submission_fields)
@@ -0,0 +1,32 @@
+import time
+import argparse
+from distinct import parse_memory, peak_rss_bytes
+from threads import build_threads
+from metrics import add_metrics_args, instrument
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild comment threads through parent_id / link_id and export per-post and per-comment thread features.")
+    parser.add_argument("folder", type=str, help="Path to the input folder")
+    parser.add_argument("--max-memory", type=parse_memory, default="1G", help="Memory budget for linking threads, e.g. 4G; sets the number of on-disk link_id partitions (default: 1G)")
+    parser.add_argument("--partitions", type=int, default=None, help="Number of link_id partitions, overriding the estimate from --max-memory")
+    parser.add_argument("--comments", action="store_true", help="Also export the depth and reply counts of every comment to <folder>_comment_threads.tsv")
+    parser.add_argument("--trees", action="store_true", help="Also export every post's nested comment tree to <folder>_threads.jsonl")
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    folder = args.folder
+    start = time.perf_counter()
+    with instrument("build-threads", args.metrics, args.profile):
+        count, in_cycles = build_threads(
+            f'{folder}/{folder}_comments.jsonl',
+            f'{folder}/{folder}_threads.tsv',
+            f'{folder}/{folder}_comment_threads.tsv' if args.comments else None,
+            f'{folder}/{folder}_threads.jsonl' if args.trees else None,
+            args.max_memory,
+            args.partitions,
+        )
+    elapsed = time.perf_counter() - start
+    print(f"Thread features saved to {folder}/{folder}_threads.tsv")
+    if in_cycles:
+        print(f"{in_cycles} comments in reply cycles were left out of the depths, comment rows and trees (see num_in_cycles)")
+    print(f"{count} comments in {elapsed:.1f}s, {elapsed / max(count, 1) * 1e6:.1f}s per million comments, peak RSS: {peak_rss_bytes() / 2 ** 20:.1f} MiB")
@@ -1,6 +1,7 @@
 import pandas as pd
 import os
 import argparse
+from metrics import add_metrics_args, instrument
 
 def convert_json_to_tsv(input_json, output_tsv):
     # Load the JSON file
@@ -25,6 +26,7 @@ if __name__ == "__main__":
     parser.add_argument("input_json", help="Path to the input JSON file")
     parser.add_argument("output_tsv", help="Path to save the output TSV file")
     
+    add_metrics_args(parser)
     args = parser.parse_args()
-    convert_json_to_tsv(args.input_json, args.output_tsv)
-
+    with instrument("comment-filter-fields", args.metrics, args.profile):
+        convert_json_to_tsv(args.input_json, args.output_tsv)
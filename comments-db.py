@@ -1,13 +1,16 @@
 import sqlite3
-import json
 import argparse
-from tqdm import tqdm
+from stream_utils import iter_lines, loads
+from schema import COMMENT_SCHEMA
+from dedup import reddit_id_to_int
+from db_utils import add_pragma_args, apply_pragmas, load_jsonl, report_skipped, create_indexes, create_fts_index, id_columns, uses_integer_ids, COMMENTS_INDEXES
+from metrics import active, add_metrics_args, instrument
 
-def create_table(cursor):
+def create_table(cursor, integer_ids=False):
     """Creates the comments table if it doesn't exist."""
-    cursor.execute("""
+    cursor.execute(f"""
         CREATE TABLE IF NOT EXISTS comments (
-            id TEXT PRIMARY KEY,
+            {id_columns(integer_ids)},
             author TEXT,
             subreddit TEXT,
             link_id TEXT,
@@ -25,58 +28,101 @@ def create_table(cursor):
         )
     """)
 
-def count_lines(filename):
-    with open(filename, 'rb') as f:
-        return sum(1 for _ in f)
+INSERT_SQL = """
+    INSERT OR IGNORE INTO comments 
+    (id, author, subreddit, link_id, parent_id, score, ups, downs, created_utc, body, author_flair_text, 
+     controversiality, subreddit_id, retrieved_on, edited)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
-def insert_data(cursor, jsonl_file):
-    total_lines = count_lines(jsonl_file)
-    with open(jsonl_file, "r", encoding="utf-8") as file:
-        for line in tqdm(file, desc="Inserting data", unit="entry", total=total_lines):
-            comment = json.loads(line.strip())
-            cursor.execute("""
-                INSERT OR IGNORE INTO comments 
-                (id, author, subreddit, link_id, parent_id, score, ups, downs, created_utc, body, author_flair_text, 
-                 controversiality, subreddit_id, retrieved_on, edited)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                comment.get("id"),
-                comment.get("author", "unknown"),
-                comment.get("subreddit", "unknown"),
-                comment.get("link_id", "unknown"),
-                comment.get("parent_id", "unknown"),
-                comment.get("score", -1),
-                comment.get("ups", -1.0),
-                comment.get("downs", -1.0),
-                comment.get("created_utc", -1),
-                comment.get("body", ""),
-                comment.get("author_flair_text", ""),
-                comment.get("controversiality", -1),
-                comment.get("subreddit_id", ""),
-                comment.get("retrieved_on", -1.0),
-                comment.get("edited") if isinstance(comment.get("edited"), int) else -1
-            ))
+def comment_row(comment):
+    # Missing fields get the placeholders the table has always had ("unknown", "", -1), the queries rely on them
+    return (
+        comment.get("id"),
+        comment.get("author", "unknown"),
+        comment.get("subreddit", "unknown"),
+        comment.get("link_id", "unknown"),
+        comment.get("parent_id", "unknown"),
+        comment.get("score", -1),
+        comment.get("ups", -1.0),
+        comment.get("downs", -1.0),
+        comment.get("created_utc", -1),
+        comment.get("body", ""),
+        comment.get("author_flair_text", ""),
+        comment.get("controversiality", -1),
+        comment.get("subreddit_id", ""),
+        comment.get("retrieved_on", -1.0),
+        comment.get("edited") if isinstance(comment.get("edited"), int) else -1
+    )
+
+INTEGER_IDS_INSERT_SQL = f"""
+    INSERT OR IGNORE INTO comments (id_int, {", ".join(COMMENT_SCHEMA.fields)})
+    VALUES ({", ".join("?" * (len(COMMENT_SCHEMA.fields) + 1))})
+"""
+
+def integer_id_comment_row(comment):
+    id_int = reddit_id_to_int(comment.get("id"))
+    return None if id_int is None else (id_int,) + comment_row(comment)
+
+def insert_data(cursor, jsonl_file, integer_ids=False):
+    sql, make_row = (INTEGER_IDS_INSERT_SQL, integer_id_comment_row) if integer_ids else (INSERT_SQL, comment_row)
+    metrics = active()
+    skipped_rows = ignored_rows = 0
+    for line in metrics.wrap(iter_lines(jsonl_file, desc="Inserting data"), "read"):
+        with metrics.phase("parse"):
+            row = make_row(loads(line))
+        if row is None:
+            skipped_rows += 1
+            continue
+        with metrics.phase("write"):
+            cursor.execute(sql, row)
+        ignored_rows += cursor.rowcount == 0
+    report_skipped(skipped_rows, ignored_rows)
+
+def bulk_insert_data(conn, jsonl_file, batch_size=10000, resume=True, integer_ids=False):
+    # Streams the file (no pre-count): rows are built in a worker process and inserted with executemany,
+    # one transaction per batch committed with a byte-offset checkpoint. Reruns only insert the new lines.
+    if integer_ids:
+        load_jsonl(conn, INTEGER_IDS_INSERT_SQL, jsonl_file, integer_id_comment_row, batch_size, resume)
+    else:
+        load_jsonl(conn, INSERT_SQL, jsonl_file, comment_row, batch_size, resume)
 
 def main():
     parser = argparse.ArgumentParser(description="Insert JSONL data into a SQLite database.")
     parser.add_argument("folder", type=str, help="Folder containing the JSONL data files")
+    parser.add_argument("--bulk", action="store_true", help="Batched, transactional, resumable bulk load with tuned PRAGMAs")
+    parser.add_argument("--fts", action="store_true", help="Also build the full-text index over body (comments_fts) after the load")
+    parser.add_argument("--from_start", action="store_true", help="With --bulk, ignore the checkpoint and read the file from the beginning")
+    parser.add_argument("--integer_ids", action="store_true", help="Key a new table by the base-36 id as an integer (id_int INTEGER PRIMARY KEY), for files deduplicated with --dedup or dedup-jsonl.py")
+    add_pragma_args(parser)
+    add_metrics_args(parser)
     args = parser.parse_args()
 
-    # Connect to SQLite database
-    conn = sqlite3.connect(f"{args.folder}/{args.folder}_comments.db")
-    cursor = conn.cursor()
+    with instrument("comments-db", args.metrics, args.profile):
+        # Connect to SQLite database
+        conn = sqlite3.connect(f"{args.folder}/{args.folder}_comments.db")
+        cursor = conn.cursor()
 
-    # Create table
-    create_table(cursor)
+        # Create table
+        create_table(cursor, args.integer_ids)
+        if uses_integer_ids(cursor, "comments") != args.integer_ids:
+            parser.error(f"the comments table already exists {'without' if args.integer_ids else 'with'} integer ids, rerun {'without' if args.integer_ids else 'with'} --integer_ids")
 
-    # Insert data
-    insert_data(cursor, f"{args.folder}/{args.folder}_comments.jsonl")
+        # Insert data
+        if args.bulk:
+            apply_pragmas(cursor, args.journal_mode, args.synchronous, args.cache_size)
+            bulk_insert_data(conn, f"{args.folder}/{args.folder}_comments.jsonl", args.batch_size, not args.from_start, args.integer_ids)
+        else:
+            insert_data(cursor, f"{args.folder}/{args.folder}_comments.jsonl", args.integer_ids)
 
-    # Commit and close connection
-    conn.commit()
-    conn.close()
+        # Commit, then build the secondary indexes after the load
+        conn.commit()
+        create_indexes(conn, COMMENTS_INDEXES)
+        if args.fts:
+            create_fts_index(conn, "comments")
+        conn.close()
 
-    print("Data successfully inserted into the database.")
+        print("Data successfully inserted into the database.")
 
 if __name__ == "__main__":
     main()
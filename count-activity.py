@@ -0,0 +1,68 @@
+import os
+import argparse
+import pandas as pd
+from collections import Counter
+from stream_utils import iter_lines, loads
+from distinct import DistinctCounter, parse_memory, peak_rss_bytes
+from encoding import count_by_author
+from metrics import add_metrics_args, instrument
+
+def count_comments_and_unique_posts(file_path, max_memory=None, error=None):
+    counter = DistinctCounter(max_memory=max_memory, error=error, tmp_dir=os.path.dirname(os.path.abspath(file_path)))
+
+    # Single streaming pass, only author and link_id are looked at
+    for line in iter_lines(file_path, desc="Counting comments"):
+        comment = loads(line)
+        author = comment.get("author")
+        link_id = comment.get("link_id")  # Post identifier
+
+        if author and author != "[deleted]" and link_id:
+            counter.add(author, link_id)
+
+    return dict(counter.items())
+
+def count_posts_by_author(file_path):
+    post_counts = Counter()
+
+    for line in iter_lines(file_path, desc="Counting posts"):
+        author = loads(line).get("author")
+        if author and author != "[deleted]":
+            post_counts[author] += 1
+
+    return post_counts
+
+def export_summary(comment_data, post_counts, output_file):
+    # Same table as count-summary.py: outer join on the author, missing counts are 0, and ties in
+    # #comments_on_unique_posts ordered by author like the sorted keys of its merge
+    authors = sorted(comment_data.keys() | post_counts.keys())
+    summary = pd.DataFrame({
+        "Author": authors,
+        "#comments": [comment_data.get(author, (0, 0))[0] for author in authors],
+        "#comments_on_unique_posts": [comment_data.get(author, (0, 0))[1] for author in authors],
+        "#posts": [post_counts.get(author, 0) for author in authors],
+    })
+    summary.sort_values('#comments_on_unique_posts', ascending=False, kind='stable').to_csv(output_file, sep="\t", index=False)
+    print(f"User summary saved to {output_file}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the per-user activity summary from the comments and submissions JSONL files in one pass each.")
+    parser.add_argument("folder", type=str, help="Path to the input folder")
+    parser.add_argument("--max-memory", type=parse_memory, default=None, help="Memory budget for the per-user state, e.g. 4G; state beyond it is spilled to disk (default: unbounded)")
+    parser.add_argument("--approx-error", type=float, default=None, help="Count distinct posts of prolific users with HyperLogLog at this relative error, e.g. 0.01 (default: exact)")
+    parser.add_argument("--encoded", action="store_true", help="Count from the integer codes saved by encode-ids.py instead of the JSONL files")
+    add_metrics_args(parser)
+    args = parser.parse_args()
+    if args.encoded and (args.max_memory or args.approx_error):
+        parser.error("--encoded counts exactly from the codes in memory, it can't be combined with --max-memory or --approx-error")
+
+    with instrument("count-activity", args.metrics, args.profile) as metrics:
+        with metrics.phase("aggregate"):
+            if args.encoded:
+                comment_data = count_by_author(args.folder, "comments", distinct=True)
+                post_counts = count_by_author(args.folder, "submissions")
+            else:
+                comment_data = count_comments_and_unique_posts(f'{args.folder}/{args.folder}_comments.jsonl', args.max_memory, args.approx_error)
+                post_counts = count_posts_by_author(f'{args.folder}/{args.folder}_submissions.jsonl')
+        with metrics.phase("write"):
+            export_summary(comment_data, post_counts, f'{args.folder}/{args.folder}_user_summary.tsv')
+        print(f"Peak RSS: {peak_rss_bytes() / 2 ** 20:.1f} MiB")
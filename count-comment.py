@@ -1,32 +1,82 @@
+import os
 import json
 import pandas as pd
 import argparse
-from collections import defaultdict
 from tqdm import tqdm
+from distinct import DistinctCounter, parse_memory, peak_rss_bytes, parallel_distinct_count
+from parquet_utils import iter_parquet_counts
+from encoding import count_by_author
+from metrics import active, add_metrics_args, instrument
+from stream_utils import ProgressReader, iter_lines, loads, read_watermark, write_watermark, check_watermark, input_fingerprint
 
-def count_comments_and_unique_posts(file_path, chunk_size=10000):
-    user_comment_counts = defaultdict(int)
-    user_unique_posts = defaultdict(set)
+def count_comments_and_unique_posts(file_path, chunk_size=10000, max_memory=None, error=None):
+    # Comment counts and distinct link_ids per author, spilled to disk past max_memory
+    counter = DistinctCounter(max_memory=max_memory, error=error, tmp_dir=os.path.dirname(os.path.abspath(file_path)))
 
-    # Estimate total lines for progress bar
-    with open(file_path, 'r', encoding='utf-8') as file:
-        total_lines = sum(1 for _ in file)
+    metrics = active()
 
-    # Read file in chunks with pandas
-    with open(file_path, 'r', encoding='utf-8') as file:
+    # Read file in chunks with pandas, the progress bar follows the bytes read
+    with ProgressReader(file_path, desc="Processing JSONL") as file, metrics.phase("aggregate"):
         reader = pd.read_json(file, lines=True, chunksize=chunk_size)
         
-        for chunk in tqdm(reader, total=total_lines//chunk_size + 1, desc="Processing JSONL", unit=" chunks"):
-            for _, row in chunk.iterrows():
-                author = row.get("author")
-                link_id = row.get("link_id")  # Post identifier
-                
+        for chunk in metrics.wrap(reader, "parse"):
+            for author, link_id in zip(chunk["author"], chunk["link_id"]):  # link_id: post identifier
                 if author and author != "[deleted]" and link_id:
-                    user_comment_counts[author] += 1
-                    user_unique_posts[author].add(link_id)
+                    counter.add(author, link_id)
 
-    # Convert unique post counts from sets to integer counts
-    user_data = {user: (count, len(posts)) for user, (count, posts) in zip(user_comment_counts.keys(), zip(user_comment_counts.values(), user_unique_posts.values()))}
+    user_data = dict(metrics.wrap(counter.items(), "merge"))
+    print(f"Peak RSS: {peak_rss_bytes() / 2 ** 20:.1f} MiB")
+
+    return user_data
+
+def count_comments_and_unique_posts_parquet(dataset_dir, max_memory=None, error=None):
+    # Only the author and link_id columns are read from the Parquet dataset, and pyarrow counts the comments per
+    # (author, link_id) of each batch, so Python only sees the distinct pairs
+    counter = DistinctCounter(max_memory=max_memory, error=error, tmp_dir=os.path.dirname(os.path.abspath(dataset_dir)))
+    metrics = active()
+    with metrics.phase("aggregate"):
+        for author, link_id, count in metrics.wrap(tqdm(iter_parquet_counts(dataset_dir, ["author", "link_id"]), desc="Processing Parquet", unit=" pairs"), "read"):
+            if author and author != "[deleted]" and link_id:
+                counter.add(author, link_id, count)
+
+    user_data = dict(metrics.wrap(counter.items(), "merge"))
+    print(f"Peak RSS: {peak_rss_bytes() / 2 ** 20:.1f} MiB")
+
+    return user_data
+
+def count_comments_and_unique_posts_incremental(file_path, state_file, max_memory=None, error=None):
+    # Count only the lines appended since the last run and merge them into the saved per-author state,
+    # which keeps the distinct link_ids so the unique-post counts stay exact
+    folder = os.path.dirname(os.path.abspath(file_path))
+    key = f"count-comment:{os.path.basename(file_path)}"
+    watermark = read_watermark(state_file, key)
+    start = watermark.get("offset", 0)
+    check_watermark(file_path, watermark)
+
+    previous_state = os.path.join(folder, watermark["state"]) if "state" in watermark else None
+    counter = DistinctCounter(max_memory=max_memory, error=error, tmp_dir=folder, state_file=previous_state)
+    metrics = active()
+    consumed = {}
+    lines = metrics.wrap(iter_lines(file_path, desc="Processing JSONL", start=start, consumed=consumed), "read")
+    with metrics.phase("aggregate"):
+        for comment in metrics.wrap(map(loads, lines), "parse"):
+            author = comment.get("author")
+            link_id = comment.get("link_id")  # Post identifier
+            if author and author != "[deleted]" and link_id:
+                counter.add(author, link_id)
+
+    end = consumed['bytes']
+    # One state file per watermark, so the watermark and the state it points to are switched atomically
+    new_state = os.path.join(folder, f"{os.path.splitext(os.path.basename(file_path))[0]}_count_state.{end}.tsv")
+    with metrics.phase("merge"):
+        counter.save_state(new_state)
+    write_watermark(state_file, key, end, state=os.path.basename(new_state), **input_fingerprint(file_path, end))
+    # Both paths are absolute, so a rerun without new lines (same end offset) keeps the state it just rewrote
+    if previous_state and os.path.abspath(previous_state) != os.path.abspath(new_state):
+        os.remove(previous_state)
+
+    user_data = dict(DistinctCounter.read_state(new_state))
+    print(f"Processed bytes {start}-{end}, peak RSS: {peak_rss_bytes() / 2 ** 20:.1f} MiB")
 
     return user_data
 
@@ -39,10 +89,32 @@ def export_to_tsv(user_data, output_file):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Count comments and unique posts per user from a JSONL file and export as TSV.")
     parser.add_argument("folder", type=str, help="Path to the input folder")
-    parser.add_argument("--chunk_size", type=int, default=10000, help="Number of lines to process per chunk (default: 10000).")
+    parser.add_argument("--chunk_size", type=int, default=None, help="Number of lines to process per chunk (default: 10000).")
+    parser.add_argument("--max-memory", type=parse_memory, default=None, help="Memory budget for the per-user state, e.g. 4G; state beyond it is spilled to disk (default: unbounded)")
+    parser.add_argument("--approx-error", type=float, default=None, help="Count distinct posts of prolific users with HyperLogLog at this relative error, e.g. 0.01 (default: exact)")
+    parser.add_argument("--parquet", action="store_true", help="Read the <folder>_comments.parquet dataset instead of the JSONL file")
+    parser.add_argument("--workers", type=int, default=1, help="Aggregate byte-range shards in this many processes and merge the partial results (default: 1)")
+    parser.add_argument("--incremental", action="store_true", help="Only count the lines added since the last --incremental run and merge them into the saved counts")
+    parser.add_argument("--encoded", action="store_true", help="Count from the integer codes saved by encode-ids.py instead of the JSONL file")
 
+    add_metrics_args(parser)
     args = parser.parse_args()
+    if args.encoded and (args.incremental or args.workers > 1 or args.parquet or args.chunk_size or args.max_memory or args.approx_error):
+        parser.error("--encoded counts exactly from the codes in memory, it can't be combined with --incremental, --workers, --parquet, --chunk_size, --max-memory or --approx-error")
+    if args.incremental and (args.workers > 1 or args.parquet):
+        parser.error("--incremental reads the lines appended to the JSONL file in one process, it can't be combined with --workers or --parquet")
 
-    # Process the file and export results
-    user_data = count_comments_and_unique_posts(f'{args.folder}/{args.folder}_comments.jsonl', args.chunk_size)
-    export_to_tsv(user_data, f'{args.folder}/{args.folder}_user_comment_count.tsv')
+    with instrument("count-comment", args.metrics, args.profile) as metrics:
+        # Process the file and export results
+        if args.incremental:
+            user_data = count_comments_and_unique_posts_incremental(f'{args.folder}/{args.folder}_comments.jsonl', f'{args.folder}/{args.folder}_watermarks.json', args.max_memory, args.approx_error)
+        elif args.workers > 1:
+            user_data = parallel_distinct_count(f'{args.folder}/{args.folder}_comments.jsonl', args.workers, args.max_memory, args.approx_error)
+        elif args.encoded:
+            user_data = count_by_author(args.folder, "comments", distinct=True)
+        elif args.parquet:
+            user_data = count_comments_and_unique_posts_parquet(f'{args.folder}/{args.folder}_comments.parquet', args.max_memory, args.approx_error)
+        else:
+            user_data = count_comments_and_unique_posts(f'{args.folder}/{args.folder}_comments.jsonl', args.chunk_size or 10000, args.max_memory, args.approx_error)
+        with metrics.phase("write"):
+            export_to_tsv(user_data, f'{args.folder}/{args.folder}_user_comment_count.tsv')
@@ -1,21 +1,24 @@
+import os
 import json
 import pandas as pd
 import argparse
 from collections import Counter
 from tqdm import tqdm
+from parquet_utils import iter_parquet_counts
+from encoding import count_by_author
+from metrics import active, add_metrics_args, instrument
+from stream_utils import ProgressReader, iter_lines, loads, read_watermark, write_watermark, check_watermark, input_fingerprint
 
 def count_posts_by_author(file_path, chunk_size=10000):
     author_counts = Counter()
     
-    # Estimate total lines for progress bar
-    with open(file_path, 'r', encoding='utf-8') as file:
-        total_lines = sum(1 for _ in file)
+    metrics = active()
 
-    # Read file in chunks with pandas
-    with open(file_path, 'r', encoding='utf-8') as file:
+    # Read file in chunks with pandas, the progress bar follows the bytes read
+    with ProgressReader(file_path, desc="Processing JSONL") as file, metrics.phase("aggregate"):
         reader = pd.read_json(file, lines=True, chunksize=chunk_size)
         
-        for chunk in tqdm(reader, total=total_lines//chunk_size + 1, desc="Processing JSONL", unit=" chunks"):
+        for chunk in metrics.wrap(reader, "parse"):
             for _, row in chunk.iterrows():
                 author = row.get("author")
                 if author and author != "[deleted]":
@@ -23,6 +26,53 @@ def count_posts_by_author(file_path, chunk_size=10000):
 
     return author_counts
 
+def count_posts_by_author_parquet(dataset_dir):
+    author_counts = Counter()
+
+    # Only the author column is read from the Parquet dataset, and pyarrow counts the posts per author of each batch
+    metrics = active()
+    with metrics.phase("aggregate"):
+        for author, count in metrics.wrap(tqdm(iter_parquet_counts(dataset_dir, ["author"]), desc="Processing Parquet", unit=" authors"), "read"):
+            if author and author != "[deleted]":
+                author_counts[author] += count
+
+    return author_counts
+
+def count_posts_by_author_incremental(file_path, state_file):
+    # Count only the lines appended since the last run and add them to the saved counts
+    folder = os.path.dirname(os.path.abspath(file_path))
+    key = f"count-submission:{os.path.basename(file_path)}"
+    watermark = read_watermark(state_file, key)
+    start = watermark.get("offset", 0)
+    check_watermark(file_path, watermark)
+
+    author_counts = Counter()
+    previous_state = os.path.join(folder, watermark["state"]) if "state" in watermark else None
+    if previous_state:
+        previous = pd.read_csv(previous_state, sep='\t', keep_default_na=False)
+        author_counts.update(dict(zip(previous["Author"], previous["Post Count"])))
+
+    metrics = active()
+    consumed = {}
+    lines = metrics.wrap(iter_lines(file_path, desc="Processing JSONL", start=start, consumed=consumed), "read")
+    with metrics.phase("aggregate"):
+        for post in metrics.wrap(map(loads, lines), "parse"):
+            author = post.get("author")
+            if author and author != "[deleted]":
+                author_counts[author] += 1
+
+    end = consumed['bytes']
+    # One state file per watermark, so the watermark and the state it points to are switched atomically
+    new_state = os.path.join(folder, f"{os.path.splitext(os.path.basename(file_path))[0]}_count_state.{end}.tsv")
+    export_to_tsv(author_counts, new_state)
+    write_watermark(state_file, key, end, state=os.path.basename(new_state), **input_fingerprint(file_path, end))
+    # Both paths are absolute, so a rerun without new lines (same end offset) keeps the state it just rewrote
+    if previous_state and os.path.abspath(previous_state) != os.path.abspath(new_state):
+        os.remove(previous_state)
+    print(f"Processed bytes {start}-{end}")
+
+    return author_counts
+
 def export_to_tsv(author_counts, output_file):
     df = pd.DataFrame(author_counts.items(), columns=["Author", "Post Count"])
     df.to_csv(output_file, sep='\t', index=False, encoding='utf-8')
@@ -31,10 +81,27 @@ def export_to_tsv(author_counts, output_file):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Count posts per author from a JSONL file and export as TSV.")
     parser.add_argument("folder", type=str, help="Path to the input folder")
-    parser.add_argument("--chunk_size", type=int, default=10000, help="Number of lines to process per chunk (default: 10000).")
+    parser.add_argument("--chunk_size", type=int, default=None, help="Number of lines to process per chunk (default: 10000).")
+    parser.add_argument("--parquet", action="store_true", help="Read the <folder>_submissions.parquet dataset instead of the JSONL file")
+    parser.add_argument("--incremental", action="store_true", help="Only count the lines added since the last --incremental run and add them to the saved counts")
+    parser.add_argument("--encoded", action="store_true", help="Count from the integer codes saved by encode-ids.py instead of the JSONL file")
 
+    add_metrics_args(parser)
     args = parser.parse_args()
+    if args.encoded and (args.incremental or args.parquet or args.chunk_size):
+        parser.error("--encoded counts from the codes, it can't be combined with --incremental, --parquet or --chunk_size")
+    if args.incremental and args.parquet:
+        parser.error("--incremental reads the lines appended to the JSONL file, it can't be combined with --parquet")
 
-    # Process the file and export results
-    author_counts = count_posts_by_author(f'{args.folder}/{args.folder}_submissions.jsonl', args.chunk_size)
-    export_to_tsv(author_counts, f'{args.folder}/{args.folder}_user_post_count.tsv')
+    with instrument("count-submission", args.metrics, args.profile) as metrics:
+        # Process the file and export results
+        if args.incremental:
+            author_counts = count_posts_by_author_incremental(f'{args.folder}/{args.folder}_submissions.jsonl', f'{args.folder}/{args.folder}_watermarks.json')
+        elif args.encoded:
+            author_counts = count_by_author(args.folder, "submissions")
+        elif args.parquet:
+            author_counts = count_posts_by_author_parquet(f'{args.folder}/{args.folder}_submissions.parquet')
+        else:
+            author_counts = count_posts_by_author(f'{args.folder}/{args.folder}_submissions.jsonl', args.chunk_size or 10000)
+        with metrics.phase("write"):
+            export_to_tsv(author_counts, f'{args.folder}/{args.folder}_user_post_count.tsv')
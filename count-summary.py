@@ -1,9 +1,14 @@
 import argparse
 import pandas as pd
+from metrics import active, add_metrics_args, instrument
 
 def main(folder):
-    comments_count = pd.read_csv(f"{folder}/{folder}_user_comment_count.tsv", sep="\t")
-    submissions_count = pd.read_csv(f"{folder}/{folder}_user_post_count.tsv", sep="\t")
+    metrics = active()
+    with metrics.phase("read"):
+        comments_count = pd.read_csv(f"{folder}/{folder}_user_comment_count.tsv", sep="\t")
+        submissions_count = pd.read_csv(f"{folder}/{folder}_user_post_count.tsv", sep="\t")
+    metrics.count(len(comments_count) + len(submissions_count))
+    metrics.switch("aggregate")
     # combine based on the Author column
     combined = pd.merge(submissions_count, comments_count, on="Author", how="outer")
     # fill NaN values with 0
@@ -21,12 +26,15 @@ def main(folder):
     # adjust the order of the columns to #comments, #comments_on_unique_posts, #posts
     combined = combined[['Author', '#comments', '#comments_on_unique_posts', '#posts']]
 
-    # export to TSV
-    combined.sort_values('#comments_on_unique_posts', ascending=False).to_csv(f"{folder}/{folder}_user_summary.tsv", sep="\t", index=False)
+    # export to TSV; the outer merge sorts the authors, a stable sort keeps them in that order within ties
+    metrics.switch("write")
+    combined.sort_values('#comments_on_unique_posts', ascending=False, kind='stable').to_csv(f"{folder}/{folder}_user_summary.tsv", sep="\t", index=False)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Count posts per author from a JSONL file and export as TSV.")
     parser.add_argument("folder", type=str, help="Path to the input folder")
+    add_metrics_args(parser)
     args = parser.parse_args()
 
-    main(args.folder)
+    with instrument("count-summary", args.metrics, args.profile):
+        main(args.folder)
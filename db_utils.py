@@ -0,0 +1,216 @@
+import os
+import time
+import multiprocessing
+from queue import Empty
+from tqdm import tqdm
+from stream_utils import loads, offset_fingerprint
+from metrics import active
+
+
+def add_pragma_args(parser):
+    # Bulk-load tuning, see https://www.sqlite.org/pragma.html
+    parser.add_argument("--batch_size", type=int, default=10000, help="Rows per executemany batch and transaction (default: 10000)")
+    # WAL/NORMAL keeps the database and its load checkpoint consistent after a crash; MEMORY/OFF are faster but don't
+    parser.add_argument("--journal_mode", type=str, default="WAL", help="SQLite journal_mode used during the bulk load; MEMORY is faster, but a crash mid-load can corrupt the database (default: WAL)")
+    parser.add_argument("--synchronous", type=str, default="NORMAL", help="SQLite synchronous setting used during the bulk load; OFF is faster, but not crash-safe (default: NORMAL)")
+    parser.add_argument("--cache_size", type=int, default=-262144, help="SQLite cache_size, negative values are KiB (default: -262144, i.e. 256MiB)")
+
+
+def apply_pragmas(cursor, journal_mode="WAL", synchronous="NORMAL", cache_size=-262144):
+    cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={synchronous}")
+    cursor.execute(f"PRAGMA cache_size={int(cache_size)}")
+
+
+def create_checkpoint_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS load_checkpoints (
+            file TEXT PRIMARY KEY,
+            byte_offset INTEGER,
+            fingerprint INTEGER
+        )
+    """)
+    # Checkpoint tables written before the fingerprint existed
+    if not any(column[1] == "fingerprint" for column in cursor.execute("PRAGMA table_info(load_checkpoints)")):
+        cursor.execute("ALTER TABLE load_checkpoints ADD COLUMN fingerprint INTEGER")
+
+
+def read_checkpoint(cursor, jsonl_file):
+    """The byte offset up to which `jsonl_file` has been loaded, after checking that the file was only appended to since."""
+    row = cursor.execute("SELECT byte_offset, fingerprint FROM load_checkpoints WHERE file = ?", (os.path.basename(jsonl_file),)).fetchone()
+    if not row:
+        return 0
+    offset, fingerprint = row
+    if offset > os.path.getsize(jsonl_file) or (fingerprint is not None and fingerprint != offset_fingerprint(jsonl_file, offset)):
+        raise ValueError(f"{jsonl_file} was rewritten since it was loaded up to byte {offset}: delete the database and load it again")
+    return offset
+
+
+def _produce_batches(jsonl_file, start_offset, make_row, batch_size, queue):
+    # Runs in a separate process: read, parse and build rows while the parent writes to SQLite
+    try:
+        with open(jsonl_file, 'rb') as file:
+            file.seek(start_offset)
+            offset = start_offset
+            batch = []
+            skipped = 0
+            for line in file:
+                offset += len(line)
+                if line.strip():
+                    row = make_row(loads(line))
+                    if row is None:
+                        skipped += 1
+                    else:
+                        batch.append(row)
+                if len(batch) >= batch_size:
+                    queue.put((batch, offset, skipped))
+                    batch = []
+                    skipped = 0
+            queue.put((batch, offset, skipped))
+        queue.put(None)
+    except Exception as e:
+        queue.put(e)
+
+
+def load_jsonl(conn, sql, jsonl_file, make_row, batch_size=10000, resume=True, queue_size=8):
+    """Stream `jsonl_file` into SQLite with constant memory.
+
+    Parsing and row building (`make_row(record) -> tuple`, or None to skip the record) run in a worker
+    process, overlapped with the executemany writes in this one. Every batch is committed together with the byte offset it ends at,
+    so with `resume=True` an interrupted load continues from the last committed batch, and a load of
+    a file that has grown since only inserts the appended lines.
+    """
+    cursor = conn.cursor()
+    create_checkpoint_table(cursor)
+    conn.commit()
+    start_offset = read_checkpoint(cursor, jsonl_file) if resume else 0
+    total_bytes = os.path.getsize(jsonl_file)
+    if start_offset:
+        print(f"Resuming from byte {start_offset} of {total_bytes}")
+
+    queue = multiprocessing.Queue(maxsize=queue_size)
+    producer = multiprocessing.Process(target=_produce_batches, args=(jsonl_file, start_offset, make_row, batch_size, queue), daemon=True)
+    producer.start()
+
+    metrics = active()
+    start = time.perf_counter()
+    total_rows = 0
+    skipped_rows = 0
+    ignored_rows = 0
+    try:
+        with tqdm(total=total_bytes, initial=start_offset, desc="Inserting", unit="B", unit_scale=True) as pbar:
+            while True:
+                try:
+                    # Time waiting here is the producer (read + parse) not keeping up with the writes
+                    with metrics.phase("wait"):
+                        item = queue.get(timeout=5)
+                except Empty:
+                    if not producer.is_alive():
+                        raise RuntimeError("The row producer exited without finishing the file")
+                    continue
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                batch, offset, skipped = item
+                with metrics.phase("write"), conn:  # the batch and its checkpoint are committed together
+                    changes = conn.total_changes
+                    conn.executemany(sql, batch)
+                    ignored_rows += len(batch) - (conn.total_changes - changes)
+                    conn.execute("INSERT OR REPLACE INTO load_checkpoints (file, byte_offset, fingerprint) VALUES (?, ?, ?)", (os.path.basename(jsonl_file), offset, offset_fingerprint(jsonl_file, offset)))
+                total_rows += len(batch)
+                skipped_rows += skipped
+                metrics.count(len(batch), offset - pbar.n)
+                pbar.update(offset - pbar.n)
+    finally:
+        producer.join(timeout=1)
+        if producer.is_alive():
+            producer.terminate()
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {total_rows} rows in {elapsed:.1f}s ({total_rows / max(elapsed, 1e-9):,.0f} rows/s)")
+    report_skipped(skipped_rows, ignored_rows)
+    return total_rows
+
+
+def report_skipped(skipped_rows, ignored_rows):
+    if skipped_rows:
+        print(f"Skipped {skipped_rows} rows without a base-36 id")
+    if ignored_rows:
+        # INSERT OR IGNORE keeps the first copy of an id, not the one with the latest retrieved_on
+        print(f"Warning: {ignored_rows} rows had an id already in the table and were ignored; "
+              f"deduplicate the file with dedup-jsonl.py first to keep the latest retrieved_on of each id")
+
+
+def id_columns(integer_ids):
+    # With integer ids the base-36 id, as an integer, is the rowid: inserts and conflict checks go through
+    # the table's own B-tree instead of an extra unique index on the id text. Rows without such an id are
+    # skipped: a NULL rowid would be assigned max(rowid) + 1, which may be the id of a row loaded later.
+    return "id_int INTEGER PRIMARY KEY,\n            id TEXT" if integer_ids else "id TEXT PRIMARY KEY"
+
+
+def uses_integer_ids(cursor, table):
+    return any(column[1] == "id_int" for column in cursor.execute(f"PRAGMA table_info({table})"))
+
+
+# Covering indexes for the per-author aggregations, built once the data is loaded
+COMMENTS_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_comments_author_link_id ON comments (author, link_id)",
+]
+POSTS_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_posts_author_id ON posts (author, id)",
+]
+
+
+def create_indexes(conn, statements):
+    start = time.perf_counter()
+    with active().phase("index"), conn:
+        for statement in statements:
+            conn.execute(statement)
+    print(f"Indexes built in {time.perf_counter() - start:.1f}s")
+
+
+# Full-text indexes over the text columns: external-content FTS5 tables that keep only the index,
+# the text itself stays in the base table
+FTS_COLUMNS = {
+    "comments": ["body"],
+    "posts": ["title", "selftext"],
+}
+
+
+def create_fts_index(conn, table, tokenizer="unicode61 remove_diacritics 2"):
+    """Index the text columns of `table` in `<table>_fts`, in bulk, once the base table is loaded.
+
+    Only the rows loaded since the last call are added, so it can follow every (incremental) load.
+    """
+    cursor = conn.cursor()
+    fts_table = f"{table}_fts"
+    columns = ", ".join(FTS_COLUMNS[table])
+    start = time.perf_counter()
+    with active().phase("index"), conn:
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5({columns}, content='{table}', content_rowid='rowid', tokenize='{tokenizer}')")
+        if uses_integer_ids(cursor, table):
+            # The rowids are the reddit ids, which an incremental load doesn't insert in increasing order
+            cursor = conn.execute(f"INSERT INTO {fts_table} (rowid, {columns}) SELECT rowid, {columns} FROM {table} t "
+                                  f"WHERE NOT EXISTS (SELECT 1 FROM {fts_table}_docsize d WHERE d.id = t.rowid)")
+        else:
+            # Rows are only ever appended to the base table, so the highest indexed rowid marks where to continue
+            last_rowid = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {fts_table}_docsize").fetchone()[0]
+            cursor = conn.execute(f"INSERT INTO {fts_table} (rowid, {columns}) SELECT rowid, {columns} FROM {table} WHERE rowid > ?", (last_rowid,))
+        added = cursor.rowcount
+        conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('optimize')")
+    print(f"Full-text index {fts_table}: {added} rows added in {time.perf_counter() - start:.1f}s")
+
+
+def search_fts(conn, table, query, limit=20):
+    """Best matches of an FTS5 `query` (e.g. 'pineapple pizza', '"hot pot" NOT spicy') as (id, author, rank, snippet)."""
+    fts_table = f"{table}_fts"
+    # bm25 ranks lower-is-better; titles weigh more than selftext
+    weights = ", ".join(["2.0", "1.0"][:len(FTS_COLUMNS[table])])
+    return conn.execute(f"""
+        SELECT t.id, t.author, bm25({fts_table}, {weights}) AS rank, snippet({fts_table}, -1, '[', ']', '...', 12)
+        FROM {fts_table} JOIN {table} t ON t.rowid = {fts_table}.rowid
+        WHERE {fts_table} MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    """, (query, limit)).fetchall()
@@ -0,0 +1,19 @@
+import argparse
+from distinct import parse_memory
+from dedup import dedup_jsonl
+from metrics import add_metrics_args, instrument
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drop duplicate ids from the cleaned comments and submissions JSONL files, keeping the latest retrieved_on of each.")
+    parser.add_argument("folder", type=str, help="Path to the input folder")
+    parser.add_argument("--kinds", nargs="+", choices=["comments", "submissions"], default=["comments", "submissions"], help="Files to deduplicate (default: both)")
+    parser.add_argument("--max-memory", type=parse_memory, default="1G", help="Memory budget for matching the ids, e.g. 4G; sets the number of on-disk id partitions (default: 1G)")
+    parser.add_argument("--partitions", type=int, default=None, help="Number of id partitions, overriding the estimate from --max-memory")
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    with instrument("dedup", args.metrics, args.profile):
+        for kind in args.kinds:
+            file_path = f'{args.folder}/{args.folder}_{kind}.jsonl'
+            kept, dropped = dedup_jsonl(file_path, max_memory=args.max_memory, partitions=args.partitions)
+            print(f"{file_path}: dropped {dropped} duplicate {kind}, {kept} left")
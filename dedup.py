@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+from array import array
+import numpy as np
+from stream_utils import iter_lines, loads, estimate_partitions
+from schema import to_int
+from metrics import active
+
+# In-memory cost of one (id, retrieved_on, line) entry while its partition is resolved: the entry plus
+# numpy's sort keys and permutation
+ENTRY_BYTES = 64
+_FLUSH_ENTRIES = 3 * 2 ** 16
+
+
+def reddit_id_to_int(reddit_id):
+    """The base-36 integer of an id such as '8xwlg' or a fullname such as 't1_8xwlg', None if it isn't one."""
+    if reddit_id is None:
+        return None
+    try:
+        value = int(str(reddit_id).rpartition('_')[2], 36)
+    except ValueError:
+        return None
+    return value if value < 2 ** 63 else None
+
+
+def _scan(file_path, tmp_dir, partitions):
+    # Pass 1: the (id, retrieved_on, line number) of every line, appended to the partition of its id.
+    # Lines without a usable id can't be matched with anything and are always kept.
+    paths = [os.path.join(tmp_dir, f"part-{partition:04d}.bin") for partition in range(partitions)]
+    buffers = [array('q') for _ in range(partitions)]
+    unkeyed = array('q')
+    count = 0
+
+    def flush(partition):
+        with open(paths[partition], 'ab') as file:
+            buffers[partition].tofile(file)
+        buffers[partition] = array('q')
+
+    for count, line in enumerate(iter_lines(file_path, desc="Scanning ids"), 1):
+        record = loads(line)
+        key = reddit_id_to_int(record.get("id"))
+        if key is None:
+            unkeyed.append(count - 1)
+            continue
+        retrieved_on = to_int(record.get("retrieved_on"))
+        buffer = buffers[key % partitions]
+        buffer.extend((key, -1 if retrieved_on is None else retrieved_on, count - 1))
+        if len(buffer) >= _FLUSH_ENTRIES:
+            flush(key % partitions)
+    for partition in range(partitions):
+        flush(partition)
+    return paths, count, unkeyed
+
+
+def _resolve(paths, count, unkeyed):
+    # Per id, the line with the latest retrieved_on wins, the later line on ties; returns a bitmap over line numbers
+    keep = np.zeros(count, dtype=bool)
+    keep[np.frombuffer(unkeyed, dtype=np.int64)] = True
+    for path in paths:
+        entries = np.fromfile(path, dtype=np.int64).reshape(-1, 3)
+        os.remove(path)
+        if not len(entries):
+            continue
+        order = np.lexsort((entries[:, 2], entries[:, 1], entries[:, 0]))
+        keys = entries[order, 0]
+        last_of_key = np.append(keys[1:] != keys[:-1], True)
+        keep[entries[order[last_of_key], 2]] = True
+    return keep
+
+
+def dedup_jsonl(input_jsonl, output_jsonl=None, max_memory=2 ** 30, partitions=None):
+    """Drop the records of `input_jsonl` whose id appears again, keeping the copy with the latest retrieved_on.
+
+    Ids are compared as base-36 integers. The (id, retrieved_on, line) entries are shuffled into on-disk
+    partitions by id, so that only one partition is sorted in memory at a time (`max_memory` sets their
+    number), and the surviving lines are written in their original order, unchanged. Without `output_jsonl`
+    the file is replaced. Returns (kept, dropped).
+    """
+    output_jsonl = output_jsonl or input_jsonl
+    partitions = partitions or estimate_partitions(input_jsonl, max_memory, ENTRY_BYTES)
+    metrics = active()
+    tmp_dir = tempfile.mkdtemp(prefix="dedup-", dir=os.path.dirname(os.path.abspath(output_jsonl)))
+    try:
+        with metrics.phase("scan"):
+            paths, count, unkeyed = _scan(input_jsonl, tmp_dir, partitions)
+        with metrics.phase("resolve"):
+            keep = _resolve(paths, count, unkeyed)
+
+        # Pass 2: copy the surviving lines
+        kept = int(keep.sum())
+        if kept == count and output_jsonl == input_jsonl:
+            return kept, 0
+        tmp_output = os.path.join(tmp_dir, "deduplicated.jsonl")
+        with open(tmp_output, 'wb') as out_file, metrics.phase("write"):
+            for index, line in enumerate(iter_lines(input_jsonl, desc="Writing")):
+                if keep[index]:
+                    out_file.write(line if line.endswith(b'\n') else line + b'\n')
+        shutil.move(tmp_output, output_jsonl)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return kept, count - kept
@@ -0,0 +1,345 @@
+import os
+import zlib
+import math
+import multiprocessing
+import heapq
+import hashlib
+import shutil
+import tempfile
+from array import array
+from tqdm import tqdm
+from stream_utils import iter_range_lines, split_byte_ranges, loads
+from metrics import active, init_worker, worker_timings, peak_rss_bytes
+
+# Rough per-entry costs used to keep the in-memory state under the memory budget
+AUTHOR_OVERHEAD_BYTES = 200
+LINK_BYTES = 8
+# Sorted runs merged at once, more are merged in rounds so that a small memory budget can't exhaust the file descriptors
+MAX_MERGE_FILES = 64
+
+_MASK64 = (1 << 64) - 1
+
+
+def parse_memory(value):
+    """Parse a size such as '512M', '4G' or '1073741824' into bytes."""
+    units = {"K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30, "T": 2 ** 40}
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def link_id_to_int(link_id):
+    """Intern a post fullname such as 't3_8xwlg' as its base-36 integer id."""
+    try:
+        value = int(link_id.rpartition('_')[2], 36)
+        if value < 2 ** 63:
+            return value
+    except (ValueError, AttributeError):
+        pass
+    # Not a reddit id: a negative id that can't collide with real ones, from a hash of the string so that
+    # every worker process and every --incremental run gives the same link_id the same id
+    digest = hashlib.blake2b(str(link_id).encode('utf-8'), digest_size=8).digest()
+    return -1 - (int.from_bytes(digest, 'big') >> 1)
+
+
+def _hash64(value):
+    # splitmix64 finalizer, spreads sequential ids over the whole 64-bit range
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+class HyperLogLog:
+    """Approximate distinct counter over integer ids, with 2**precision one-byte registers."""
+
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision, registers=None):
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+
+    @staticmethod
+    def precision_for_error(error):
+        # The standard error of HyperLogLog is about 1.04 / sqrt(m)
+        return min(16, max(4, math.ceil(math.log2((1.04 / error) ** 2))))
+
+    def add(self, value):
+        hashed = _hash64(value)
+        index = hashed >> (64 - self.precision)
+        rest = (hashed << self.precision) & _MASK64
+        rank = 64 - self.precision + 1 if rest == 0 else 65 - rest.bit_length()
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class DistinctCounter:
+    """Per-author comment counts and distinct post counts, kept under a memory budget.
+
+    Post ids are interned as base-36 integers. In exact mode each author keeps an integer array,
+    compacted (sorted, deduplicated) when the budget is hit. With `error` set, authors with more
+    distinct posts than their HyperLogLog would weigh switch to an approximate counter.
+    When compaction isn't enough, the state is spilled to sorted run files that are merged at the end.
+    `state_file` is a previous save_state() output (or a list of them) to continue from.
+    """
+
+    def __init__(self, max_memory=None, error=None, tmp_dir=None, state_file=None):
+        self.max_memory = max_memory
+        self.state_files = [state_file] if isinstance(state_file, str) else list(state_file or [])
+        self.precision = HyperLogLog.precision_for_error(error) if error else None
+        self.tmp_dir = tmp_dir
+        self.counts = {}
+        self.links = {}
+        self.estimated_bytes = 0
+        self.runs = []
+
+    def add(self, author, link_id, count=1):
+        # `count` comments of `author` on the same post
+        counts = self.counts
+        if author in counts:
+            counts[author] += count
+            links = self.links[author]
+        else:
+            counts[author] = count
+            links = self.links[author] = array('q')
+            self.estimated_bytes += AUTHOR_OVERHEAD_BYTES
+        link = link_id_to_int(link_id)
+        if type(links) is array:
+            links.append(link)
+            self.estimated_bytes += LINK_BYTES
+            if self.precision is not None and len(links) * LINK_BYTES > (2 << self.precision):
+                # Prolific author, move it to HyperLogLog right away
+                self.estimated_bytes -= len(links) * LINK_BYTES
+                self.estimated_bytes += self._state_bytes(self._compact(author, links))
+        else:
+            links.add(link)
+        if self.max_memory and self.estimated_bytes > self.max_memory:
+            self._shrink()
+
+    def _compact(self, author, links):
+        links = array('q', sorted(set(links)))
+        if self.precision is not None and len(links) * LINK_BYTES > (1 << self.precision):
+            hll = HyperLogLog(self.precision)
+            for link in links:
+                hll.add(link)
+            links = hll
+        self.links[author] = links
+        return links
+
+    def _state_bytes(self, links):
+        return len(links) * LINK_BYTES if type(links) is array else len(links.registers)
+
+    def _shrink(self):
+        self.estimated_bytes = 0
+        for author, links in list(self.links.items()):
+            if type(links) is array:
+                links = self._compact(author, links)
+            self.estimated_bytes += AUTHOR_OVERHEAD_BYTES + self._state_bytes(links)
+        # Spill when compaction freed less than half of the budget
+        if self.estimated_bytes > self.max_memory // 2:
+            self._spill()
+
+    def _spill(self):
+        fd, path = tempfile.mkstemp(prefix="distinct-run-", suffix=".tsv", dir=self.tmp_dir)
+        with active().phase("spill"), os.fdopen(fd, 'w', encoding='utf-8') as run:
+            for author in sorted(self.counts):
+                run.write(self._serialize(author, self.counts[author], self.links[author]))
+        self.runs.append(path)
+        self.counts = {}
+        self.links = {}
+        self.estimated_bytes = 0
+
+    @staticmethod
+    def _serialize(author, count, links):
+        if type(links) is array:
+            return f"{author}\t{count}\tx\t{','.join(map(str, sorted(set(links))))}\n"
+        return f"{author}\t{count}\th{links.precision}\t{links.registers.hex()}\n"
+
+    @staticmethod
+    def _deserialize(line):
+        author, count, kind, payload = line.rstrip('\n').split('\t')
+        if kind == 'x':
+            links = array('q', map(int, payload.split(','))) if payload else array('q')
+        else:
+            links = HyperLogLog(int(kind[1:]), bytearray.fromhex(payload))
+        return author, int(count), links
+
+    def _merge_states(self, first, second):
+        if type(first) is array and type(second) is array:
+            return array('q', sorted(set(first) | set(second)))
+        if type(first) is array:
+            first, second = second, first
+        if type(second) is array:
+            for link in second:
+                first.add(link)
+        else:
+            first.merge(second)
+        return first
+
+    @staticmethod
+    def _distinct(links):
+        return len(set(links)) if type(links) is array else links.count()
+
+    def _merge_files(self, paths):
+        # Yield (author, count, links) in author order, k-way merging sorted state files
+        files = [open(path, 'r', encoding='utf-8') for path in paths]
+        try:
+            current_author, current_count, current_links = None, 0, None
+            for author, count, links in heapq.merge(*(map(self._deserialize, f) for f in files), key=lambda state: state[0]):
+                if author == current_author:
+                    current_count += count
+                    current_links = self._merge_states(current_links, links)
+                    continue
+                if current_author is not None:
+                    yield current_author, current_count, current_links
+                current_author, current_count, current_links = author, count, links
+            if current_author is not None:
+                yield current_author, current_count, current_links
+        finally:
+            for f in files:
+                f.close()
+
+    def _merged_states(self):
+        # Yield (author, count, links) in author order, merging the sorted runs and the saved state
+        if self.counts or not (self.runs or self.state_files):
+            self._spill()
+        try:
+            paths = self.runs + self.state_files
+            while len(paths) > MAX_MERGE_FILES:
+                merged = []
+                for i in range(0, len(paths), MAX_MERGE_FILES):
+                    group = paths[i:i + MAX_MERGE_FILES]
+                    fd, path = tempfile.mkstemp(prefix="distinct-run-", suffix=".tsv", dir=self.tmp_dir)
+                    self.runs.append(path)
+                    with active().phase("spill"), os.fdopen(fd, 'w', encoding='utf-8') as run:
+                        for state in self._merge_files(group):
+                            run.write(self._serialize(*state))
+                    # The runs of the group aren't needed anymore, the saved state files are kept
+                    for done in group:
+                        if done in self.runs:
+                            self.runs.remove(done)
+                            os.remove(done)
+                    merged.append(path)
+                paths = merged
+            yield from self._merge_files(paths)
+        finally:
+            for path in self.runs:
+                os.remove(path)
+            self.runs = []
+
+    def items(self):
+        """Yield (author, (comment count, distinct post count)), merging spilled runs if any."""
+        if not self.runs and not self.state_files:
+            for author, count in self.counts.items():
+                yield author, (count, self._distinct(self.links[author]))
+            return
+
+        for author, count, links in self._merged_states():
+            yield author, (count, self._distinct(links))
+
+    def save_state(self, path):
+        """Write the merged per-author state (counts and distinct post ids) to `path`, sorted by author.
+
+        A counter created with `state_file=path` continues from it, so distinct counts stay exact across runs.
+        """
+        # `path` may be one of the state files being merged: write aside and swap it in at the end
+        with open(path + ".tmp", 'w', encoding='utf-8') as state:
+            for author, count, links in self._merged_states():
+                state.write(self._serialize(author, count, links))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def read_state(cls, path):
+        """Yield (author, (comment count, distinct post count)) from a file written by save_state."""
+        with open(path, 'r', encoding='utf-8') as state:
+            for line in state:
+                author, count, links = cls._deserialize(line)
+                yield author, (count, cls._distinct(links))
+
+
+def author_partition(author, partitions):
+    # crc32 rather than hash(): it must agree across worker processes
+    return zlib.crc32(author.encode('utf-8')) % partitions
+
+
+def _map_range(task):
+    # Map: aggregate one byte range of the comments file into one partial state file per author partition
+    file_path, start, end, partitions, max_memory, error, tmp_dir = task
+    counters = [DistinctCounter(max_memory=max_memory and max_memory // partitions, error=error, tmp_dir=tmp_dir) for _ in range(partitions)]
+    metrics = active()
+    with metrics.phase("aggregate"):
+        for line in iter_range_lines(file_path, start, end):
+            comment = loads(line)
+            author = comment.get("author")
+            link_id = comment.get("link_id")  # Post identifier
+            if author and author != "[deleted]" and link_id:
+                counters[author_partition(author, partitions)].add(author, link_id)
+    paths = []
+    with metrics.phase("write"):
+        for partition, counter in enumerate(counters):
+            path = os.path.join(tmp_dir, f"map-{start}-{partition}.tsv")
+            counter.save_state(path)
+            paths.append(path)
+    return end - start, paths, worker_timings()
+
+
+def _reduce_partition(task):
+    # Reduce: merge the partials of one author partition; partitions hold disjoint authors
+    paths, error, tmp_dir = task
+    counter = DistinctCounter(error=error, tmp_dir=tmp_dir, state_file=paths)
+    with active().phase("merge"):
+        user_data = list(counter.items())
+    for path in paths:
+        os.remove(path)
+    return user_data, worker_timings()
+
+
+def parallel_distinct_count(file_path, workers, max_memory=None, error=None, range_size=256 * 2 ** 20):
+    """Map/reduce version of counting comments and distinct posts per author over a json lines file.
+
+    Workers aggregate newline-aligned byte ranges into partial states hash-partitioned by author,
+    then one reduce task per partition merges them. Returns {author: (comment count, distinct post count)}.
+    """
+    total_bytes = os.path.getsize(file_path)
+    ranges = split_byte_ranges(file_path, max(workers, -(-total_bytes // range_size)))
+    # The partial states and spilled runs live in their own directory, removed even if a worker fails
+    tmp_dir = tempfile.mkdtemp(prefix="distinct-", dir=os.path.dirname(os.path.abspath(file_path)))
+    # Each concurrent map task gets its share of the memory budget
+    worker_memory = max_memory and max_memory // workers
+    tasks = [(file_path, start, end, workers, worker_memory, error, tmp_dir) for start, end in ranges]
+
+    metrics = active()
+    partition_paths = [[] for _ in range(workers)]
+    try:
+        with multiprocessing.Pool(workers, initializer=init_worker, initargs=(metrics.enabled,)) as pool:
+            with metrics.phase("map"), tqdm(total=total_bytes, desc="Map", unit="B", unit_scale=True) as pbar:
+                for done_bytes, paths, timings in pool.imap_unordered(_map_range, tasks):
+                    for partition, path in enumerate(paths):
+                        partition_paths[partition].append(path)
+                    pbar.update(done_bytes)
+                    metrics.count(nbytes=done_bytes)
+                    metrics.add_workers(timings)
+
+            user_data = {}
+            reduce_tasks = [(paths, error, tmp_dir) for paths in partition_paths]
+            with metrics.phase("reduce"):
+                for partition_data, timings in tqdm(pool.imap_unordered(_reduce_partition, reduce_tasks), total=workers, desc="Reduce", unit=" partitions"):
+                    user_data.update(partition_data)
+                    metrics.add_workers(timings)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return user_data
@@ -0,0 +1,13 @@
+import argparse
+from encoding import encode_folder
+from metrics import add_metrics_args, instrument
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dictionary-encode the authors and link_ids of the cleaned comments and submissions JSONL files as dense integer codes.")
+    parser.add_argument("folder", type=str, help="Path to the input folder")
+    add_metrics_args(parser)
+    args = parser.parse_args()
+
+    with instrument("encode-ids", args.metrics, args.profile):
+        num_authors, num_links = encode_folder(args.folder)
+        print(f"Encoded {num_authors} authors and {num_links} links to {args.folder}/{args.folder}_codes.npz")
@@ -0,0 +1,136 @@
+import os
+from array import array
+import numpy as np
+from stream_utils import iter_lines, loads
+from schema import column_decoder
+from metrics import active
+
+KINDS = ["comments", "submissions"]
+
+# Codes reserved in both dictionaries, so that the scripts' filters are integer comparisons
+MISSING, EMPTY, DELETED = 0, 1, 2
+_RESERVED = [None, "", "[deleted]"]
+
+
+class Dictionary:
+    """Dense codes of strings in the order they are first seen, None being code 0."""
+
+    def __init__(self):
+        self.names = list(_RESERVED)
+        self.codes = {name: code for code, name in enumerate(self.names)}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.names)
+            self.names.append(value)
+        return code
+
+
+def write_names(path, names):
+    # One name per line in code order; code 0 (None) isn't written
+    with open(path + ".tmp", 'w', encoding='utf-8', newline='\n') as file:
+        for name in names[1:]:
+            if '\n' in name:
+                raise ValueError(f"Can't encode {name!r}: it contains a newline")
+            file.write(name + '\n')
+    os.replace(path + ".tmp", path)
+
+
+def read_names(path):
+    """The names of a dictionary, indexed by code."""
+    with open(path, encoding='utf-8', newline='\n') as file:
+        return [None] + file.read().split('\n')[:-1]
+
+
+def _encode_file(file_path, link_field, authors, links):
+    # Submissions are keyed by their fullname, so that both files share the link codes
+    decode = column_decoder(["author", link_field])
+    prefix = "t3_" if link_field == "id" else ""
+    author_codes, link_codes = array('i'), array('i')
+    stat = os.stat(file_path)
+    for line in iter_lines(file_path, desc=f"Encoding {os.path.basename(file_path)}", end=stat.st_size):
+        author, link = decode(loads(line))
+        author_codes.append(authors.encode(author))
+        link_codes.append(links.encode(prefix + link if link else link))
+    return np.frombuffer(author_codes, dtype=np.int32), np.frombuffer(link_codes, dtype=np.int32), stat
+
+
+def encode_folder(folder):
+    """Dictionary-encode the author and link_id (id for submissions) of both cleaned files of `folder` in one pass.
+
+    Saves `<folder>_codes.npz` with one int32 code per line and column, and the names of the author and link
+    codes, one per line, in `<folder>_authors.txt` and `<folder>_links.txt`. Returns the number of authors and links.
+    """
+    authors, links = Dictionary(), Dictionary()
+    arrays = {}
+    with active().phase("encode"):
+        for kind, link_field in zip(KINDS, ["link_id", "id"]):
+            author_codes, link_codes, stat = _encode_file(f'{folder}/{folder}_{kind}.jsonl', link_field, authors, links)
+            arrays.update({f"{kind}_author": author_codes, f"{kind}_link": link_codes,
+                           f"{kind}_bytes": np.int64(stat.st_size), f"{kind}_mtime_ns": np.int64(stat.st_mtime_ns)})
+
+    with active().phase("write"):
+        codes_file = f'{folder}/{folder}_codes.npz'
+        with open(codes_file + ".tmp", 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(codes_file + ".tmp", codes_file)
+        write_names(f'{folder}/{folder}_authors.txt', authors.names)
+        write_names(f'{folder}/{folder}_links.txt', links.names)
+    return len(authors.names) - len(_RESERVED), len(links.names) - len(_RESERVED)
+
+
+def load_codes(folder, kind):
+    """(author codes, link codes) of the lines of the `kind` file of `folder`, checked to be up to date."""
+    codes_file = f'{folder}/{folder}_codes.npz'
+    jsonl_file = f'{folder}/{folder}_{kind}.jsonl'
+    with np.load(codes_file) as codes:
+        # A rewrite of the same size (e.g. edited in place) still changes the modification time
+        if os.path.exists(jsonl_file):
+            stat = os.stat(jsonl_file)
+            if (stat.st_size, stat.st_mtime_ns) != (int(codes[f"{kind}_bytes"]), int(codes[f"{kind}_mtime_ns"])):
+                raise ValueError(f"{jsonl_file} changed since {codes_file} was encoded from it: rerun encode-ids.py")
+        return codes[f"{kind}_author"], codes[f"{kind}_link"]
+
+
+def count_per(keys, size=0):
+    """Number of occurrences of every code."""
+    return np.bincount(keys, minlength=size)
+
+
+def distinct_per(keys, values, size=0):
+    """Number of distinct `values` of every code of `keys`: the (key, value) pairs are packed into int64 and sort-uniqued."""
+    pairs = np.unique((keys.astype(np.int64) << 32) | values)
+    return np.bincount(pairs >> 32, minlength=size)
+
+
+def first_seen(keys):
+    """The distinct codes of `keys` in the order they first appear."""
+    unique, first = np.unique(keys, return_index=True)
+    return unique[np.argsort(first)]
+
+
+def count_by_author(folder, kind, distinct=False):
+    """{author: rows} of the `kind` file of `folder`, or {author: (rows, distinct links)} with `distinct`.
+
+    Missing, empty and [deleted] authors, and the comments without a link_id, are skipped like the
+    dict-based counters do, and the authors come in the order they first appear.
+    """
+    metrics = active()
+    with metrics.phase("read"):
+        authors, links = load_codes(folder, kind)
+    with metrics.phase("aggregate"):
+        valid = authors > DELETED
+        if distinct:
+            valid &= links > EMPTY
+        authors, links = authors[valid], links[valid]
+        counts = count_per(authors)
+        unique = distinct_per(authors, links) if distinct else None
+        order = first_seen(authors)
+    metrics.count(len(valid))
+
+    # Names are only decoded for the output rows
+    names = read_names(f'{folder}/{folder}_authors.txt')
+    if distinct:
+        return {names[code]: (int(counts[code]), int(unique[code])) for code in order}
+    return {names[code]: int(counts[code]) for code in order}
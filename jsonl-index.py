@@ -0,0 +1,33 @@
+import sys
+import time
+import json
+import argparse
+from offset_index import build_indexes, OffsetIndex, DEFAULT_KEYS
+from metrics import add_metrics_args, instrument
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build byte-offset indexes over a cleaned JSONL file and fetch records by id, author or link_id.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Index a JSONL file")
+    build_parser.add_argument("jsonl_file", type=str, help="Path to the cleaned JSONL file, e.g. chinesefood/chinesefood_comments.jsonl")
+    build_parser.add_argument("--keys", nargs="+", default=DEFAULT_KEYS, help="Fields to index (default: id author link_id)")
+    add_metrics_args(build_parser)
+
+    query_parser = subparsers.add_parser("query", help="Fetch the records matching a key value")
+    query_parser.add_argument("jsonl_file", type=str, help="Path to the indexed JSONL file")
+    query_parser.add_argument("key", type=str, help="Indexed field, e.g. author")
+    query_parser.add_argument("value", type=str, help="Value to look up")
+    query_parser.add_argument("--limit", type=int, default=None, help="Maximum number of records to return")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        with instrument("jsonl-index", args.metrics, args.profile):
+            build_indexes(args.jsonl_file, args.keys)
+    else:
+        start = time.perf_counter()
+        count = 0
+        for record in OffsetIndex(args.jsonl_file, args.key).lookup(args.value, args.limit):
+            print(json.dumps(record, ensure_ascii=False))
+            count += 1
+        print(f"{count} records in {(time.perf_counter() - start) * 1000:.1f}ms", file=sys.stderr)
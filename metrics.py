@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import resource
+import cProfile
+import pstats
+from contextlib import contextmanager, nullcontext
+
+try:
+    import pyinstrument
+except ImportError:  # optional, cProfile is used otherwise
+    pyinstrument = None
+
+_DONE = object()
+
+
+def peak_rss_bytes():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Metrics:
+    """Wall time per phase, rows and bytes processed and peak memory of one script run, written as JSON lines.
+
+    Time is attributed to one phase at a time (read, parse, project, aggregate, write, ...): entering a phase
+    pauses the enclosing one, so the phase times add up to the elapsed time. A "progress" line is written
+    every `interval` seconds while rows are being counted, and a "summary" line at the end. The phase times
+    of worker processes, sent back with add_workers(), are summed separately. With `output` None nothing is
+    written: that is the Metrics of a worker (see init_worker).
+    """
+
+    enabled = True
+
+    def __init__(self, stage, output, interval=30.0):
+        self.stage = stage
+        self.output = None if output is None else sys.stderr if output == "-" else open(output, 'a', encoding='utf-8')
+        self.interval = interval
+        self.seconds = {}
+        self.worker_seconds = {}
+        self.rows = 0
+        self.bytes = 0
+        self.current = "other"
+        self.start = self.mark = self.last_progress = time.perf_counter()
+
+    def switch(self, phase):
+        """Charge the time since the last switch to the current phase, make `phase` current and return the previous one."""
+        now = time.perf_counter()
+        self.seconds[self.current] = self.seconds.get(self.current, 0.0) + now - self.mark
+        self.mark = now
+        previous, self.current = self.current, phase
+        return previous
+
+    @contextmanager
+    def phase(self, name):
+        previous = self.switch(name)
+        try:
+            yield
+        finally:
+            self.switch(previous)
+
+    def wrap(self, iterable, phase):
+        """Iterate over `iterable`, charging the time spent producing each item to `phase`."""
+        iterator = iter(iterable)
+        while True:
+            previous = self.switch(phase)
+            try:
+                item = next(iterator, _DONE)
+            finally:
+                self.switch(previous)
+            if item is _DONE:
+                return
+            yield item
+
+    def add_workers(self, timings):
+        """Add the phase times a worker returned from worker_timings()."""
+        for phase, seconds in timings.items():
+            self.worker_seconds[phase] = self.worker_seconds.get(phase, 0.0) + seconds
+
+    def count(self, rows=0, nbytes=0):
+        self.rows += rows
+        self.bytes += nbytes
+        now = time.perf_counter()
+        if now - self.last_progress >= self.interval:
+            self.last_progress = now
+            self.emit("progress", **self.snapshot())
+
+    def snapshot(self):
+        self.switch(self.current)  # bring the current phase up to date
+        elapsed = time.perf_counter() - self.start
+        snapshot = {
+            "elapsed_s": round(elapsed, 3),
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "rows_per_s": round(self.rows / elapsed, 1) if elapsed else None,
+            "bytes_per_s": round(self.bytes / elapsed, 1) if elapsed else None,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "phases_s": {phase: round(seconds, 3) for phase, seconds in sorted(self.seconds.items(), key=lambda item: -item[1])},
+        }
+        if self.worker_seconds:
+            # Summed over the workers, so they can exceed the elapsed time
+            snapshot["worker_phases_s"] = {phase: round(seconds, 3) for phase, seconds in sorted(self.worker_seconds.items(), key=lambda item: -item[1])}
+        return snapshot
+
+    def emit(self, event, **fields):
+        if self.output is None:
+            return
+        record = {"ts": round(time.time(), 3), "stage": self.stage, "event": event, "pid": os.getpid()}
+        record.update(fields)
+        self.output.write(json.dumps(record) + "\n")
+        self.output.flush()
+
+    def close(self):
+        self.emit("summary", **self.snapshot())
+        if self.output is not None and self.output is not sys.stderr:
+            self.output.close()
+
+
+class _NullMetrics:
+    # Used when metrics are off: every hook is a no-op and wrap() hands the iterable back untouched
+
+    enabled = False
+
+    def switch(self, phase):
+        return phase
+
+    def phase(self, name):
+        return nullcontext()
+
+    def wrap(self, iterable, phase):
+        return iterable
+
+    def add_workers(self, timings):
+        pass
+
+    def count(self, rows=0, nbytes=0):
+        pass
+
+    def emit(self, event, **fields):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_METRICS = _NullMetrics()
+_active = NULL_METRICS
+
+
+def active():
+    """The Metrics of the running script, or a no-op stand-in when --metrics wasn't given."""
+    return _active
+
+
+def init_worker(enabled):
+    """Pool initializer of the worker processes, also called first thing in a multiprocessing.Process target.
+
+    A forked worker inherits the Metrics of the parent and would write its progress lines into the parent's file:
+    it gets its own, writing nothing, whose phase times worker_timings() hands back (or a no-op one unless `enabled`).
+    """
+    global _active
+    _active = Metrics("worker", None) if enabled else NULL_METRICS
+
+
+def worker_timings():
+    """The phase times of this worker since the last call, for the parent's add_workers(); {} when metrics are off.
+
+    Time outside any phase (waiting for the next task) is left out.
+    """
+    metrics = _active
+    if not metrics.enabled:
+        return {}
+    metrics.switch(metrics.current)
+    timings = {phase: seconds for phase, seconds in metrics.seconds.items() if phase != "other"}
+    metrics.seconds = {}
+    return timings
+
+
+def add_metrics_args(parser):
+    parser.add_argument("--metrics", type=str, default=None, help="Append per-phase timings, rows/s, bytes/s and peak memory as JSON lines to this file ('-' for stderr)")
+    parser.add_argument("--profile", type=str, default=None, help="Profile the run: cProfile stats to this file, or a pyinstrument HTML report if it ends with .html and pyinstrument is installed")
+
+
+def _start_profiler(profile_file):
+    if not profile_file:
+        return None
+    if profile_file.endswith(".html") and pyinstrument is not None:
+        profiler = pyinstrument.Profiler()
+    else:
+        if profile_file.endswith(".html"):
+            print("pyinstrument is not installed, writing cProfile stats instead", file=sys.stderr)
+        profiler = cProfile.Profile()
+    if isinstance(profiler, cProfile.Profile):
+        profiler.enable()
+    else:
+        profiler.start()
+    return profiler
+
+
+def _stop_profiler(profiler, profile_file):
+    if profiler is None:
+        return
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(15)
+    else:
+        profiler.stop()
+        with open(profile_file, 'w', encoding='utf-8') as report:
+            report.write(profiler.output_html())
+    print(f"Profile saved to {profile_file}", file=sys.stderr)
+
+
+@contextmanager
+def instrument(stage, metrics_file=None, profile_file=None):
+    """Collect the metrics (if `metrics_file`) and the profile (if `profile_file`) of the enclosed run."""
+    global _active
+    metrics = Metrics(stage, metrics_file) if metrics_file else NULL_METRICS
+    _active = metrics
+    metrics.emit("start", argv=sys.argv[1:])
+    profiler = _start_profiler(profile_file)
+    try:
+        yield metrics
+    except BaseException as e:
+        metrics.emit("error", error=repr(e))
+        raise
+    finally:
+        _stop_profiler(profiler, profile_file)
+        metrics.close()
+        _active = NULL_METRICS
@@ -0,0 +1,106 @@
+import os
+import hashlib
+from array import array
+import numpy as np
+from stream_utils import loads
+from metrics import active
+from tqdm import tqdm
+
+# Each index file is a 32-byte header (magic, number of records, size and modification time of the indexed
+# file) followed by (key hash, line offset) records sorted by hash
+INDEX_MAGIC = b"JSONLID2"
+HEADER_SIZE = 32
+RECORD_DTYPE = np.dtype([("hash", "<u8"), ("offset", "<u8")])
+DEFAULT_KEYS = ["id", "author", "link_id"]
+
+
+def index_path(jsonl_file, key):
+    return f"{jsonl_file}.{key}.idx"
+
+
+def key_hash(value):
+    # 64-bit hash of the key value; collisions are filtered out when the records are read back
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def build_indexes(jsonl_file, keys=DEFAULT_KEYS):
+    """Scan `jsonl_file` once and write one sorted offset index per key, e.g. <file>.author.idx."""
+    # array('Q') keeps 8 bytes per entry instead of a Python int
+    hashes = {key: array('Q') for key in keys}
+    offsets = {key: array('Q') for key in keys}
+    stat = os.stat(jsonl_file)
+    total_bytes = stat.st_size
+    with open(jsonl_file, 'rb') as file, tqdm(total=total_bytes, desc="Indexing", unit="B", unit_scale=True) as pbar:
+        position = 0
+        i = -1
+        for i, line in enumerate(file):
+            if position + len(line) > total_bytes:
+                break  # appended while indexing, not covered by the recorded size
+            if line.strip():
+                record = loads(line)
+                for key in keys:
+                    value = record.get(key)
+                    if value is not None:
+                        hashes[key].append(key_hash(value))
+                        offsets[key].append(position)
+            position += len(line)
+            if i % 100000 == 0:
+                pbar.update(position - pbar.n)
+        pbar.update(total_bytes - pbar.n)
+    active().count(i + 1, total_bytes)
+
+    for key in keys:
+        records = np.empty(len(hashes[key]), dtype=RECORD_DTYPE)
+        records["hash"] = np.frombuffer(hashes[key], dtype="<u8")
+        records["offset"] = np.frombuffer(offsets[key], dtype="<u8")
+        records.sort(order=["hash", "offset"])  # offsets ascending within a key keeps file order
+        with open(index_path(jsonl_file, key), 'wb') as out_file:
+            out_file.write(INDEX_MAGIC + len(records).to_bytes(8, 'little') + total_bytes.to_bytes(8, 'little') + stat.st_mtime_ns.to_bytes(8, 'little'))
+            out_file.write(records.tobytes())
+        print(f"Index saved at: {index_path(jsonl_file, key)} ({len(records)} entries)")
+
+
+class OffsetIndex:
+    """Memory-mapped offset index of one key of a json lines file."""
+
+    def __init__(self, jsonl_file, key):
+        self.jsonl_file = jsonl_file
+        self.key = key
+        path = index_path(jsonl_file, key)
+        with open(path, 'rb') as file:
+            header = file.read(HEADER_SIZE)
+        if header[:8] != INDEX_MAGIC:
+            raise ValueError(f"{path} is not an offset index, or one built by an older version: rerun jsonl-index.py build")
+        count, size, mtime_ns = (int.from_bytes(header[start:start + 8], 'little') for start in (8, 16, 24))
+        # Offsets into a file that was appended to or rewritten (e.g. by --dedup) would return the wrong lines
+        stat = os.stat(jsonl_file)
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+            raise ValueError(f"{jsonl_file} changed since {path} was built: rerun jsonl-index.py build")
+        self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,)) if count else np.empty(0, dtype=RECORD_DTYPE)
+
+    def offsets(self, value):
+        """Byte offsets of the lines whose key may equal `value` (hash matches), in file order."""
+        hashed = np.uint64(key_hash(value))
+        hashes = self.records["hash"]
+        start = np.searchsorted(hashes, hashed, side='left')
+        end = np.searchsorted(hashes, hashed, side='right')
+        return self.records["offset"][start:end].tolist()
+
+    def lookup(self, value, limit=None):
+        """Yield the records whose key equals `value`, by seeking to each indexed line."""
+        found = 0
+        with open(self.jsonl_file, 'rb') as file:
+            for offset in self.offsets(value):
+                file.seek(offset)
+                record = loads(file.readline())
+                if str(record.get(self.key)) != str(value):
+                    continue  # hash collision
+                yield record
+                found += 1
+                if limit is not None and found >= limit:
+                    return
+
+
+def lookup(jsonl_file, key, value, limit=None):
+    """Records of `jsonl_file` whose `key` equals `value`, using the index built by build_indexes."""
+    return list(OffsetIndex(jsonl_file, key).lookup(value, limit))
@@ -0,0 +1,104 @@
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+except ImportError:  # the Parquet tier is optional
+    pa = ds = pafs = None
+
+from stream_utils import loads
+from schema import FIELD_TYPES, column_decoder, to_str, to_json, to_int, to_edited, to_float, to_bool
+from metrics import active
+
+# Columns that repeat a lot and are stored dictionary-encoded
+DICTIONARY_COLUMNS = ["author", "link_id", "subreddit", "subreddit_id", "parent_id", "domain"]
+PARTITION_COLUMN = "month"
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("The Parquet tier needs pyarrow: pip install pyarrow")
+
+
+def _arrow_types():
+    # Arrow type of each declared field type
+    return {to_str: pa.string(), to_json: pa.string(), to_int: pa.int64(), to_edited: pa.int64(), to_float: pa.float64(), to_bool: pa.bool_()}
+
+
+def month_of(created_utc):
+    if created_utc is None:
+        return "unknown"
+    tm = time.gmtime(created_utc)
+    return f"{tm.tm_year:04d}-{tm.tm_mon:02d}"
+
+
+def _record_batches(lines, fields, schema, batch_size):
+    decode = column_decoder(fields)
+    columns = {name: [] for name in schema.names}
+    for line in lines:
+        for field, value in zip(fields, decode(loads(line))):
+            columns[field].append(value)
+        columns[PARTITION_COLUMN].append(month_of(columns["created_utc"][-1]))
+        if len(columns[PARTITION_COLUMN]) == batch_size:
+            yield pa.RecordBatch.from_pydict(columns, schema=schema)
+            columns = {name: [] for name in schema.names}
+    if columns[PARTITION_COLUMN]:
+        yield pa.RecordBatch.from_pydict(columns, schema=schema)
+
+
+def write_parquet_dataset(lines, output_dir, fields, batch_size=100000):
+    """Write the projection of `lines` onto `fields` as a Parquet dataset partitioned by month of created_utc.
+
+    The files are zstd-compressed and the repetitive string columns are dictionary-encoded.
+    """
+    _require_pyarrow()
+    arrow_types = _arrow_types()
+    schema = pa.schema([(field, arrow_types[FIELD_TYPES[field]]) for field in fields] + [(PARTITION_COLUMN, pa.string())])
+
+    file_format = ds.ParquetFileFormat()
+    write_options = file_format.make_write_options(
+        compression="zstd",
+        use_dictionary=[column for column in DICTIONARY_COLUMNS if column in fields],
+    )
+    ds.write_dataset(
+        _record_batches(lines, fields, schema, batch_size),
+        output_dir,
+        schema=schema,
+        format=file_format,
+        file_options=write_options,
+        partitioning=ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor="hive"),
+        existing_data_behavior="delete_matching",
+        max_rows_per_group=batch_size,
+    )
+
+
+def open_parquet_dataset(dataset_dir):
+    """Open a dataset written by write_parquet_dataset, memory-mapped, with dictionary columns kept encoded."""
+    _require_pyarrow()
+    file_format = ds.ParquetFileFormat(read_options=ds.ParquetReadOptions(dictionary_columns=DICTIONARY_COLUMNS))
+    return ds.dataset(dataset_dir, format=file_format, partitioning="hive", filesystem=pafs.LocalFileSystem(use_mmap=True))
+
+
+def iter_parquet_batches(dataset_dir, columns, batch_size=100000):
+    """Yield RecordBatches holding only `columns`; other columns are never read from disk."""
+    metrics = active()
+    for batch in open_parquet_dataset(dataset_dir).to_batches(columns=columns, batch_size=batch_size):
+        metrics.count(batch.num_rows, batch.nbytes)
+        yield batch
+
+
+def iter_parquet_rows(dataset_dir, columns, batch_size=100000):
+    """Yield tuples of `columns` values, batch by batch."""
+    for batch in iter_parquet_batches(dataset_dir, columns, batch_size):
+        yield from zip(*(batch.column(column).to_pylist() for column in columns))
+
+
+def iter_parquet_counts(dataset_dir, columns, batch_size=100000):
+    """Yield tuples of `columns` values followed by their number of rows, grouped by pyarrow within each batch.
+
+    A value combination spanning several batches comes back once per batch, the caller sums them.
+    """
+    for batch in iter_parquet_batches(dataset_dir, columns, batch_size):
+        counts = pa.Table.from_batches([batch]).group_by(columns).aggregate([([], "count_all")])
+        yield from zip(*(counts.column(column).to_pylist() for column in columns + ["count_all"]))
@@ -0,0 +1,197 @@
+import os
+from array import array
+import numpy as np
+import pandas as pd
+from parquet_utils import iter_parquet_rows
+from stream_utils import iter_lines, loads
+from schema import column_decoder
+from metrics import active
+
+GRANULARITIES = ["day", "week", "month"]
+DIMENSIONS = ["author", "subreddit"]
+MEASURES = ["comments", "posts", "comment_score", "post_score"]
+
+SECONDS_PER_DAY = 86400
+_CODE_BITS = 32
+_CODE_MASK = (1 << _CODE_BITS) - 1
+
+
+def _reduce(keys, values):
+    # Sum the measure rows sharing a (bucket, code) key; keys come back sorted
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    summed = np.empty((len(unique_keys), values.shape[1]), dtype=np.int64)
+    for column in range(values.shape[1]):
+        summed[:, column] = np.bincount(inverse, weights=values[:, column], minlength=len(unique_keys))
+    return unique_keys, summed
+
+
+def _rebucket(keys, granularity):
+    # Day keys to week (starting on Monday) or month keys
+    days = keys >> _CODE_BITS
+    codes = keys & _CODE_MASK
+    if granularity == "week":
+        buckets = days - (days + 3) % 7  # 1970-01-01 was a Thursday
+    elif granularity == "month":
+        buckets = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    else:
+        buckets = days
+    return (buckets << _CODE_BITS) | codes
+
+
+def bucket_dates(buckets, granularity):
+    """First day of each bucket, as datetime64[D]."""
+    if granularity == "month":
+        return buckets.astype("datetime64[M]").astype("datetime64[D]")
+    return buckets.astype("datetime64[D]")
+
+
+def _iter_rows(path, parquet):
+    # (created_utc, author, subreddit, score) of every record
+    columns = ["created_utc", "author", "subreddit", "score"]
+    if parquet:
+        yield from iter_parquet_rows(path, columns)
+        return
+    decode = column_decoder(columns)
+    for line in iter_lines(path, desc=f"Reading {os.path.basename(path)}"):
+        yield decode(loads(line))
+
+
+class _Cube:
+    """Day-level partial aggregates of one dimension, folded in chunk by chunk.
+
+    The reduced partials of the chunks are buffered and only merged once they outnumber the rows of the
+    cube merged so far, so every row is re-reduced a bounded number of times rather than at every chunk.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.merged_rows = self.pending_rows = 0
+
+    def fold(self, keys, values):
+        keys, values = _reduce(keys, values)
+        self.parts.append((keys, values))
+        self.pending_rows += len(keys)
+        if self.pending_rows > self.merged_rows:
+            self._merge()
+
+    def _merge(self):
+        if len(self.parts) != 1:
+            keys, values = _reduce(np.concatenate([keys for keys, _ in self.parts]), np.concatenate([values for _, values in self.parts]))
+            self.parts = [(keys, values)]
+        self.merged_rows, self.pending_rows = len(self.parts[0][0]), 0
+
+    def result(self):
+        """The sorted day keys and their summed measures."""
+        if not self.parts:
+            return np.empty(0, dtype=np.int64), np.empty((0, len(MEASURES)), dtype=np.int64)
+        self._merge()
+        return self.parts[0]
+
+
+def build_rollup(comments_file, submissions_file, output_file, chunk_size=1000000, parquet=False):
+    """One pass over created_utc, author, subreddit and score of both files, materialized as a compact cube.
+
+    For every granularity (day, week, month) and dimension (author, subreddit) the cube stores the sorted
+    (bucket << 32 | code) keys and the comments, posts, comment_score and post_score sums per key,
+    with the author and subreddit names of the codes, in one .npz file.
+    """
+    names = {dimension: {} for dimension in DIMENSIONS}
+    cubes = {dimension: _Cube() for dimension in DIMENSIONS}
+    skipped = 0
+    metrics = active()
+
+    for kind, path in (("comments", comments_file), ("posts", submissions_file)):
+        count_column = MEASURES.index(kind)
+        score_column = MEASURES.index("comment_score" if kind == "comments" else "post_score")
+        days, scores = array('q'), array('q')
+        codes = {dimension: array('q') for dimension in DIMENSIONS}
+        rows = _iter_rows(path, parquet)
+        while True:
+            for created_utc, author, subreddit, score in rows:
+                if created_utc is None:
+                    skipped += 1
+                    continue
+                days.append(created_utc // SECONDS_PER_DAY)
+                scores.append(score if score is not None else 0)
+                codes["author"].append(names["author"].setdefault(author or "[deleted]", len(names["author"])))
+                codes["subreddit"].append(names["subreddit"].setdefault(subreddit or "unknown", len(names["subreddit"])))
+                if len(days) == chunk_size:
+                    break
+            if not days:
+                break
+            day_keys = np.frombuffer(days, dtype=np.int64) << _CODE_BITS
+            values = np.zeros((len(days), len(MEASURES)), dtype=np.int64)
+            values[:, count_column] = 1
+            values[:, score_column] = np.frombuffer(scores, dtype=np.int64)
+            with metrics.phase("aggregate"):
+                for dimension in DIMENSIONS:
+                    cubes[dimension].fold(day_keys | np.frombuffer(codes[dimension], dtype=np.int64), values)
+            days, scores = array('q'), array('q')
+            codes = {dimension: array('q') for dimension in DIMENSIONS}
+
+    arrays = {"measures": np.array(MEASURES)}
+    with metrics.phase("aggregate"):
+        for dimension in DIMENSIONS:
+            arrays[f"{dimension}_names"] = np.array(list(names[dimension]), dtype=str)
+            day_keys, day_values = cubes[dimension].result()
+            for granularity in GRANULARITIES:
+                keys, values = _reduce(_rebucket(day_keys, granularity), day_values)
+                arrays[f"{granularity}_{dimension}_keys"] = keys
+                arrays[f"{granularity}_{dimension}_values"] = values
+    with metrics.phase("write"):
+        np.savez_compressed(output_file, **arrays)
+    if skipped:
+        print(f"Skipped {skipped} records without created_utc")
+    return {dimension: len(names[dimension]) for dimension in DIMENSIONS}
+
+
+class ActivityCube:
+    """Query API over a cube written by build_rollup, e.g.
+
+        cube = ActivityCube("chinesefood/chinesefood_rollup.npz")
+        cube.query("month", "author", keys=["some_user"])     # comments and posts per month of one user
+        cube.totals("day")                                    # comments and posts per day
+    """
+
+    def __init__(self, path):
+        self.arrays = dict(np.load(path))
+        self.measures = list(self.arrays["measures"])
+        self.names = {dimension: self.arrays[f"{dimension}_names"] for dimension in DIMENSIONS}
+        self._codes = {}
+
+    def code_of(self, dimension, name):
+        if dimension not in self._codes:
+            self._codes[dimension] = {value: code for code, value in enumerate(self.names[dimension].tolist())}
+        return self._codes[dimension].get(name)
+
+    def query(self, granularity="month", by="author", keys=None, start=None, end=None):
+        """Measures per bucket and `by` value, optionally for some `keys` (names) and buckets in [start, end].
+
+        `start` and `end` are dates such as '2020-01' or '2020-01-15'; a bucket is selected by its first day.
+        """
+        if granularity not in GRANULARITIES or by not in DIMENSIONS:
+            raise ValueError(f"granularity must be one of {GRANULARITIES} and by one of {DIMENSIONS}")
+        cube_keys = self.arrays[f"{granularity}_{by}_keys"]
+        values = self.arrays[f"{granularity}_{by}_values"]
+        codes = cube_keys & _CODE_MASK
+        dates = bucket_dates(cube_keys >> _CODE_BITS, granularity)
+
+        mask = np.ones(len(cube_keys), dtype=bool)
+        if keys is not None:
+            wanted = [code for code in (self.code_of(by, key) for key in keys) if code is not None]
+            mask &= np.isin(codes, wanted)
+        if start is not None:
+            mask &= dates >= np.datetime64(start).astype("datetime64[D]")
+        if end is not None:
+            mask &= dates <= np.datetime64(end).astype("datetime64[D]")
+
+        labels = dates[mask].astype("datetime64[M]" if granularity == "month" else "datetime64[D]").astype(str)
+        result = pd.DataFrame({granularity: labels, by: self.names[by][codes[mask]]})
+        for column, measure in enumerate(self.measures):
+            result[measure] = values[mask, column]
+        return result
+
+    def totals(self, granularity="month", start=None, end=None):
+        """Measures per bucket over everything in the cube."""
+        per_subreddit = self.query(granularity, "subreddit", start=start, end=end)
+        return per_subreddit.groupby(granularity, as_index=False)[self.measures].sum()
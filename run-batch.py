@@ -0,0 +1,144 @@
+import os
+import sys
+import glob
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def theme_file(theme, suffix):
+    # A theme may be a nested folder such as data/chinesefood, whose files are data/chinesefood/chinesefood_*
+    return f"{theme}/{os.path.basename(theme)}_{suffix}"
+
+def raw_input(theme, kind, zst):
+    # The filter stage reads the .zst dump with --zst, the decompressed dump otherwise
+    return theme_file(theme, kind) + (".zst" if zst else "")
+
+STAGE_NAMES = ["filter-comments", "filter-submissions", "count-comment", "count-submission", "count-summary", "comments-db", "submissions-db"]
+
+def build_stages(theme, zst, dedup=False):
+    """The per-subreddit pipeline as a DAG: name -> (script args, inputs, outputs, dependencies).
+
+    The scripts are run from the parent folder of the theme (see run_stage) and get its base name.
+    """
+    name = os.path.basename(theme)
+    filter_args = (["--zst"] if zst else []) + (["--dedup"] if dedup else [])
+    return {
+        "filter-comments": (["comment-filter-fields-chunk.py", name] + filter_args, [raw_input(theme, "comments", zst)], [theme_file(theme, "comments.jsonl")], []),
+        "filter-submissions": (["submission-filter-chunk.py", name] + filter_args, [raw_input(theme, "submissions", zst)], [theme_file(theme, "submissions.jsonl")], []),
+        "count-comment": (["count-comment.py", name], [theme_file(theme, "comments.jsonl")], [theme_file(theme, "user_comment_count.tsv")], ["filter-comments"]),
+        "count-submission": (["count-submission.py", name], [theme_file(theme, "submissions.jsonl")], [theme_file(theme, "user_post_count.tsv")], ["filter-submissions"]),
+        "count-summary": (["count-summary.py", name], [theme_file(theme, "user_comment_count.tsv"), theme_file(theme, "user_post_count.tsv")], [theme_file(theme, "user_summary.tsv")], ["count-comment", "count-submission"]),
+        "comments-db": (["comments-db.py", name, "--bulk"], [theme_file(theme, "comments.jsonl")], [theme_file(theme, "comments.db")], ["filter-comments"]),
+        "submissions-db": (["submissions-db.py", name], [theme_file(theme, "submissions.jsonl")], [theme_file(theme, "submissions.db")], ["filter-submissions"]),
+    }
+
+def is_theme(path):
+    # A subreddit folder holds its raw comments dump or the cleaned comments; '*' also matches e.g. benchmarks/
+    theme = os.path.basename(path)
+    return any(os.path.exists(f"{path}/{theme}_comments{suffix}") for suffix in ("", ".zst", ".jsonl"))
+
+def is_up_to_date(inputs, outputs):
+    # Up to date when every output exists and is newer than every existing input
+    if not all(os.path.exists(output) for output in outputs):
+        return False
+    existing_inputs = [path for path in inputs if os.path.exists(path)]
+    if not existing_inputs:
+        return True  # e.g. the raw dump was deleted after filtering
+    return min(os.path.getmtime(output) for output in outputs) >= max(os.path.getmtime(path) for path in existing_inputs)
+
+def theme_size(theme, zst):
+    # Used to schedule the biggest subreddits first
+    paths = [raw_input(theme, kind, zst) for kind in ("comments", "submissions")] + [theme_file(theme, f"{kind}.jsonl") for kind in ("comments", "submissions")]
+    return max((os.path.getsize(path) for path in paths if os.path.exists(path)), default=0)
+
+def run_stage(theme, stage, args):
+    # The scripts read and write <folder>/<folder>_*, relative to the directory they run in
+    start = time.perf_counter()
+    with open(theme_file(theme, f"{stage}.log"), 'w', encoding='utf-8') as log:
+        result = subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, args[0])] + args[1:], stdout=log, stderr=subprocess.STDOUT, cwd=os.path.dirname(theme) or None)
+    return result.returncode, time.perf_counter() - start
+
+def run_batch(themes, jobs, zst=False, stages=None, force=False, metrics=False, dedup=False):
+    """Run the pipeline of every theme, as one DAG of stages over a pool of `jobs` concurrent stages.
+
+    With `metrics`, every stage appends its metrics to <theme>/<name>_metrics.jsonl, <name> being the base name of the theme.
+    """
+    sizes = {theme: theme_size(theme, zst) for theme in themes}
+    tasks = {}
+    for theme in themes:
+        for stage, (args, inputs, outputs, deps) in build_stages(theme, zst, dedup).items():
+            if stages is None or stage in stages:
+                name = os.path.basename(theme)
+                args = args + (["--metrics", f"{name}/{name}_metrics.jsonl"] if metrics else [])
+                tasks[(theme, stage)] = (args, inputs, outputs, [(theme, dep) for dep in deps if stages is None or dep in stages])
+
+    report = {}
+    done = set()
+    pending = dict(tasks)
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            # Start ready stages, biggest subreddits first, while there is room in the pool
+            ready = [key for key, (_, _, _, deps) in pending.items() if all(dep in done for dep in deps)]
+            ready.sort(key=lambda key: sizes[key[0]], reverse=True)
+            for key in ready:
+                args, inputs, outputs, deps = pending[key]
+                if any(report.get(dep, ("",))[0] in ("failed", "blocked") for dep in deps):
+                    report[key] = ("blocked", 0.0)
+                    done.add(key)
+                    del pending[key]
+                elif not force and not any(report.get(dep, ("",))[0] == "ran" for dep in deps) and is_up_to_date(inputs, outputs):
+                    report[key] = ("skipped", 0.0)
+                    done.add(key)
+                    del pending[key]
+                elif len(running) < jobs:
+                    running[pool.submit(run_stage, key[0], key[1], args)] = key
+                    del pending[key]
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key = running.pop(future)
+                returncode, elapsed = future.result()
+                report[key] = ("ran" if returncode == 0 else "failed", elapsed)
+                done.add(key)
+                print(f"{key[0]:<30} {key[1]:<20} {report[key][0]:<8} {elapsed:10.1f}s", flush=True)
+
+    return report
+
+def export_report(report, output_file):
+    with open(output_file, 'w', encoding='utf-8') as file:
+        file.write("subreddit\tstage\tstatus\tseconds\n")
+        for (theme, stage), (status, elapsed) in sorted(report.items()):
+            file.write(f"{theme}\t{stage}\t{status}\t{elapsed:.1f}\n")
+    print(f"Timing report saved to {output_file}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the filter, count, summary and database stages for many subreddit folders in parallel.")
+    parser.add_argument("folders", nargs="+", help="Subreddit folders or glob patterns, relative to the current directory (e.g. 'chinesefood' or '*')")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of stages run concurrently (default: number of CPUs)")
+    parser.add_argument("--zst", action="store_true", help="Filter straight from the <folder>_comments.zst / <folder>_submissions.zst dumps")
+    parser.add_argument("--stages", nargs="+", default=None, choices=STAGE_NAMES, help="Only run these stages (default: all)")
+    parser.add_argument("--force", action="store_true", help="Rerun stages even when their outputs are up to date")
+    parser.add_argument("--report", type=str, default="batch_report.tsv", help="Where to write the per-subreddit timing report")
+    parser.add_argument("--dedup", action="store_true", help="Drop duplicate ids (keeping the latest retrieved_on) right after filtering, so that the counts and databases don't see them")
+    parser.add_argument("--metrics", action="store_true", help="Have every stage append its per-phase timings, rows/s and peak memory to <folder>/<folder>_metrics.jsonl")
+    args = parser.parse_args()
+
+    themes = set()
+    for pattern in args.folders:
+        for path in glob.glob(pattern) or [pattern]:
+            path = path.rstrip('/')
+            if os.path.isdir(path) and is_theme(path):
+                themes.add(path)
+            elif not glob.has_magic(pattern):
+                print(f"Skipping {path}: no {os.path.basename(path)}_comments(.zst) or {os.path.basename(path)}_comments.jsonl in it")
+    themes = sorted(themes)
+    report = run_batch(themes, args.jobs, args.zst, set(args.stages) if args.stages else None, args.force, args.metrics, args.dedup)
+    export_report(report, args.report)
+    if any(status == "failed" for status, _ in report.values()):
+        sys.exit(1)
@@ -0,0 +1,156 @@
+import json
+from collections import namedtuple
+
+# Declared types of the cleaned comment and submission fields. Raw Pushshift lines change format across
+# years (edited is false/true or a timestamp, numbers are sometimes strings, ups/downs disappear), and the
+# pandas round-trip in the filters turns integers next to nulls into floats; decoding through the schema
+# gives every stage the same types whichever dump or filter a line comes from.
+
+
+def to_str(value):
+    if value is None or type(value) is str:
+        return value
+    return str(value)
+
+
+def to_int(value):
+    if value is None or type(value) is int:
+        return value
+    try:
+        if type(value) is str:
+            return int(float(value)) if value.strip() else None
+        return int(value)  # floats from the pandas round-trip, booleans
+    except (TypeError, ValueError, OverflowError):
+        return None  # "abc", NaN, inf: a value that can't be read is missing rather than fatal to the load
+
+
+def to_float(value):
+    # Nullable: a missing ups/downs stays None rather than a -1 placeholder
+    if value is None or type(value) is float:
+        return value
+    try:
+        if type(value) is str:
+            return float(value) if value.strip() else None
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_bool(value):
+    if value is None or type(value) is bool:
+        return value
+    if type(value) is str:
+        return value.strip().lower() in ("true", "1")
+    return bool(value)
+
+
+def to_json(value):
+    # Objects such as media are stored as their JSON text
+    if value is None or type(value) is str:
+        return value
+    return json.dumps(value)
+
+
+def to_edited(value):
+    """0 when not edited, the edit time when the dump has it, 1 when it only says true (older dumps)."""
+    if value is None:
+        return None
+    if value is True or value is False:
+        return int(value)
+    return to_int(value)
+
+
+# Python type a converter returns, values that already have it are taken as is
+NATIVE_TYPES = {to_str: str, to_json: str, to_int: int, to_edited: int, to_float: float, to_bool: bool}
+
+FIELD_TYPES = {
+    "id": to_str,
+    "author": to_str,
+    "subreddit": to_str,
+    "subreddit_id": to_str,
+    "link_id": to_str,
+    "parent_id": to_str,
+    "body": to_str,
+    "title": to_str,
+    "selftext": to_str,
+    "url": to_str,
+    "permalink": to_str,
+    "domain": to_str,
+    "author_flair_text": to_str,
+    "distinguished": to_str,
+    "media": to_json,
+    "score": to_int,
+    "num_comments": to_int,
+    "controversiality": to_int,
+    "created_utc": to_int,
+    "retrieved_on": to_int,
+    "edited": to_edited,
+    "ups": to_float,
+    "downs": to_float,
+    "is_self": to_bool,
+    "over_18": to_bool,
+    "stickied": to_bool,
+}
+
+
+def _row_decoder(fields):
+    # A tuple of per-field converters applied to the values of a record, in field order
+    fields = tuple(fields)
+    converters = tuple(FIELD_TYPES[field] for field in fields)
+    native_types = tuple(NATIVE_TYPES[convert] for convert in converters)
+
+    def row(record):
+        values = list(map(record.get, fields))
+        for i, value in enumerate(values):
+            # Missing values and values that already have their declared type (most of them) skip the converter
+            if value is not None and type(value) is not native_types[i]:
+                values[i] = converters[i](value)
+        return tuple(values)
+    return row
+
+
+class Schema:
+    """Typed decoding of the records of one kind into `Record` tuples with one attribute per field, e.g.
+
+        comment = COMMENT_SCHEMA.decode(record)
+        comment.edited, comment.ups      # int or None, float or None
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = list(fields)
+        # A namedtuple keeps no per-record __dict__: as compact as a plain tuple, and usable as a SQLite row
+        self.Record = namedtuple(name, self.fields)
+        self._row = _row_decoder(self.fields)
+
+    def __reduce__(self):
+        # Rebuilt rather than pickled, e.g. when row() is handed to a worker process
+        return Schema, (self.name, self.fields)
+
+    def row(self, record):
+        """Normalize a parsed (dict) record into a plain tuple in field order, missing fields as None."""
+        return self._row(record)
+
+    def decode(self, record):
+        """Like row(), as a Record."""
+        return self.Record._make(self.row(record))
+
+
+def column_decoder(fields):
+    """Decoder of only `fields` of a parsed record into a plain tuple, for stages that look at a few columns."""
+    return _row_decoder(fields)
+
+
+# Field order is the column order of the comments and posts tables
+COMMENT_SCHEMA = Schema("Comment", [
+    "id", "author", "subreddit", "link_id", "parent_id", "score", "ups", "downs", "created_utc", "body",
+    "author_flair_text", "controversiality", "subreddit_id", "retrieved_on", "edited",
+])
+SUBMISSION_SCHEMA = Schema("Submission", [
+    "id", "subreddit", "subreddit_id", "title", "selftext", "url", "permalink", "created_utc", "score",
+    "num_comments", "ups", "downs", "author", "author_flair_text", "is_self", "domain", "over_18", "media",
+    "edited", "stickied", "distinguished",
+])
+# Module-level names, so that the records can be pickled (e.g. sent to a worker process)
+Comment = COMMENT_SCHEMA.Record
+Submission = SUBMISSION_SCHEMA.Record
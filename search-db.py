@@ -0,0 +1,29 @@
+import time
+import sqlite3
+import argparse
+from db_utils import search_fts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keyword search over the full-text indexes built by comments-db.py --fts and submissions-db.py --fts.")
+    parser.add_argument("folder", type=str, help="Folder containing the databases")
+    parser.add_argument("query", type=str, help="FTS5 query, e.g. 'pineapple pizza', '\"hot pot\"' or 'tofu NOT spicy'")
+    parser.add_argument("--posts", action="store_true", help="Search submission titles and selftext instead of comment bodies")
+    parser.add_argument("--limit", type=int, default=20, help="Number of hits to return (default: 20)")
+    args = parser.parse_args()
+
+    kind, table = ("submissions", "posts") if args.posts else ("comments", "comments")
+    conn = sqlite3.connect(f"file:{args.folder}/{args.folder}_{kind}.db?mode=ro", uri=True)
+    start = time.perf_counter()
+    try:
+        hits = search_fts(conn, table, args.query, args.limit)
+    except sqlite3.OperationalError as e:
+        # e.g. a syntax error in the FTS5 query, or a database built without --fts; exits with code 2
+        parser.error(f"can't run the query {args.query!r}: {e}")
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start
+
+    print("id\tauthor\trank\tsnippet")
+    for post_id, author, rank, snippet in hits:
+        print(f"{post_id}\t{author}\t{rank:.2f}\t{' '.join((snippet or '').split())}")
+    print(f"{len(hits)} hits in {elapsed * 1000:.1f}ms")
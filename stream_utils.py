@@ -0,0 +1,526 @@
+import io
+import os
+import re
+import math
+import json
+import time
+import zlib
+import shutil
+import multiprocessing
+import zstandard
+from tqdm import tqdm
+from metrics import active, init_worker, worker_timings
+
+try:
+    import orjson
+except ImportError:  # fall back to the standard library parser
+    orjson = None
+
+# Pushshift dumps are compressed with --long=31, so the decoder needs a 2G window
+ZST_MAX_WINDOW_SIZE = 2 ** 31
+ZST_READ_SIZE = 2 ** 20
+# Bytes before a watermark or checkpoint whose crc32 tells an appended file from a rewritten one
+FINGERPRINT_BYTES = 2 ** 16
+
+
+def iter_zst_lines(input_zst, desc="Processing", update_every=10000, start=0, consumed=None, start_fingerprint=None):
+    """Yield the lines (bytes) of a .zst json lines dump without writing the decompressed file to disk.
+
+    The progress bar follows the compressed bytes consumed, so no pre-counting pass is needed.
+    Lines in the first `start` decompressed bytes are skipped without being returned; if `consumed`
+    is a dict, consumed['bytes'] holds the decompressed size once the dump has been read, and
+    consumed['fingerprint'] the crc32 of its last FINGERPRINT_BYTES. A `start_fingerprint` recorded that
+    way is checked before any line past `start` is returned. Skipping still decompresses those bytes:
+    a zstd frame can't be entered mid-stream, so reading from a watermark costs as much decompression
+    as reading the whole dump.
+    """
+    total_bytes = os.path.getsize(input_zst)
+    metrics = active()
+    position = counted_bytes = counted_lines = 0
+    i = -1
+    # The last decompressed bytes, for the fingerprints
+    window = bytearray() if consumed is not None or start_fingerprint is not None else None
+
+    def check_start():
+        if position != start or zlib.crc32(window[-FINGERPRINT_BYTES:]) != start_fingerprint:
+            raise ValueError(f"{input_zst} doesn't start with the {start} bytes read up to its watermark, it was rewritten: rerun without --incremental")
+
+    with open(input_zst, 'rb') as compressed, \
+            tqdm(total=total_bytes, desc=desc, unit="B", unit_scale=True) as pbar:
+        dctx = zstandard.ZstdDecompressor(max_window_size=ZST_MAX_WINDOW_SIZE)
+        with dctx.stream_reader(compressed, read_size=ZST_READ_SIZE) as reader:
+            for i, line in enumerate(io.BufferedReader(reader, buffer_size=ZST_READ_SIZE)):
+                if start_fingerprint is not None and position + len(line) > start:
+                    check_start()
+                    start_fingerprint = None
+                if window is not None:
+                    window += line
+                    if len(window) > 2 * FINGERPRINT_BYTES:
+                        del window[:-FINGERPRINT_BYTES]
+                position += len(line)
+                if position > start and line.strip():
+                    yield line
+                if i % update_every == 0:
+                    pbar.update(compressed.tell() - pbar.n)
+                    metrics.count(i + 1 - counted_lines, position - counted_bytes)
+                    counted_lines, counted_bytes = i + 1, position
+        pbar.update(total_bytes - pbar.n)
+    if start_fingerprint is not None:
+        check_start()
+    metrics.count(i + 1 - counted_lines, position - counted_bytes)
+    if consumed is not None:
+        consumed['bytes'] = position
+        consumed['fingerprint'] = zlib.crc32(window[-FINGERPRINT_BYTES:])
+
+
+def iter_lines(input_jsonl, desc="Processing", update_every=10000, start=0, end=None, consumed=None):
+    """Yield the lines (bytes) of a json lines file, with a progress bar based on the file size.
+
+    `start` and `end` restrict the reading to a line-aligned byte range, e.g. the part appended since a watermark.
+    A line that crosses `end` (still being appended when `end` was taken) isn't returned. If `consumed` is a
+    dict, a last line without its newline isn't returned either, and consumed['bytes'] holds the offset
+    reading stopped at, where the next watermark should be.
+    """
+    end = os.path.getsize(input_jsonl) if end is None else end
+    metrics = active()
+    counted_lines = 0
+    i = -1
+    with open(input_jsonl, 'rb') as file, \
+            tqdm(total=end, initial=start, desc=desc, unit="B", unit_scale=True) as pbar:
+        file.seek(start)
+        position = counted_bytes = start
+        for i, line in enumerate(file):
+            if position + len(line) > end or (consumed is not None and not line.endswith(b'\n')):
+                break  # still being appended
+            position += len(line)
+            if line.strip():
+                yield line
+            if i % update_every == 0:
+                pbar.update(position - pbar.n)
+                metrics.count(i + 1 - counted_lines, position - counted_bytes)
+                counted_lines, counted_bytes = i + 1, position
+            if position == end:
+                break
+        pbar.update(end - pbar.n)
+    metrics.count(i + 1 - counted_lines, position - counted_bytes)
+    if consumed is not None:
+        consumed['bytes'] = position
+
+
+class ProgressReader:
+    """Text lines of a json lines file for pandas' chunked read_json, with a progress bar based on the file size.
+
+    Replaces counting the lines of the file up front just to size the progress bar.
+    """
+
+    def __init__(self, input_jsonl, desc="Processing", update_every=10000):
+        self.file = open(input_jsonl, 'rb')
+        self.pbar = tqdm(total=os.path.getsize(input_jsonl), desc=desc, unit="B", unit_scale=True)
+        self.update_every = update_every
+        self.metrics = active()
+        self.lines = self.counted_lines = self.position = self.counted_bytes = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.file.readline()
+        if not line:
+            self._update()
+            raise StopIteration
+        self.lines += 1
+        self.position += len(line)
+        if self.lines % self.update_every == 0:
+            self._update()
+        return line.decode('utf-8')
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.lines += data.count(b'\n')
+        self.position += len(data)
+        self._update()
+        return data.decode('utf-8')
+
+    def _update(self):
+        self.pbar.update(self.position - self.pbar.n)
+        self.metrics.count(self.lines - self.counted_lines, self.position - self.counted_bytes)
+        self.counted_lines, self.counted_bytes = self.lines, self.position
+
+    def close(self):
+        self.pbar.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_watermark(state_file, key):
+    """Return the watermark entry of `key` (a stage and its input), e.g. {"offset": ...}, or {} on the first run."""
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r', encoding='utf-8') as file:
+        return json.load(file).get(key, {})
+
+
+def write_watermark(state_file, key, offset, **extra):
+    """Record that `key` has processed its input up to byte `offset`, along with stage-specific `extra` fields."""
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+    previous = state.get(key, {})
+    state[key] = {"offset": offset, "updated": int(time.time()), **extra}
+    # Write then rename, so an interrupted run never leaves a half-written state file
+    with open(f"{state_file}.tmp", 'w', encoding='utf-8') as file:
+        json.dump(state, file, indent=2)
+    os.replace(f"{state_file}.tmp", state_file)
+    return previous
+
+
+def offset_fingerprint(input_path, offset, size=FINGERPRINT_BYTES):
+    """crc32 of the `size` bytes before `offset`, which change when the file is rewritten rather than appended to."""
+    with open(input_path, 'rb') as file:
+        file.seek(max(offset - size, 0))
+        return zlib.crc32(file.read(min(offset, size)))
+
+
+def input_fingerprint(input_path, offset):
+    """The fields of a watermark at `offset` that check_watermark uses to recognize `input_path` on the next run."""
+    stat = os.stat(input_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "fingerprint": offset_fingerprint(input_path, offset)}
+
+
+def check_watermark(input_path, watermark):
+    # The incremental mode assumes the inputs only grow by appending new lines: the bytes before
+    # the watermark must still be the ones that were processed
+    offset = watermark.get("offset", 0)
+    stat = os.stat(input_path)
+    if (stat.st_size, stat.st_mtime_ns) == (watermark.get("size"), watermark.get("mtime_ns")):
+        return  # untouched since the watermark was written
+    if offset > stat.st_size or watermark.get("fingerprint", offset_fingerprint(input_path, offset)) != offset_fingerprint(input_path, offset):
+        raise ValueError(f"{input_path} was rewritten since its watermark ({offset} bytes): rerun without --incremental")
+
+
+def loads(line):
+    """Parse one json line with orjson when available."""
+    if orjson is not None:
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            # orjson rejects a few things the standard parser accepts (e.g. integers above 64 bits)
+            pass
+    return json.loads(line)
+
+
+def _dumps(record):
+    if orjson is not None:
+        try:
+            return orjson.dumps(record)
+        except TypeError:
+            pass
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def project_record(line, fields):
+    """Keep only `fields` of a raw json line, filling missing ones with None (null)."""
+    record = loads(line)
+    return {field: record.get(field) for field in fields}
+
+
+# pandas' json parser (precise_float=False) reads a float as integer part + at most 15 decimals * 10**-decimals,
+# times 10**exponent, which is often one unit in the last place off the correctly rounded value
+_POW10 = [float(f"1e-{n}") for n in range(16)]
+_NUMBER = re.compile(r'(-?)(\d+)(?:\.(\d+))?(?:e([-+]\d+))?')
+
+
+def _pandas_float(value):
+    """The float pandas reads from the text of `value` (its shortest repr, as json writers print it)."""
+    match = _NUMBER.fullmatch(repr(value))
+    if match is None:
+        return value  # nan or infinity
+    sign, whole, decimals, exponent = match.groups()
+    decimals = (decimals or '')[:15]
+    result = (float(int(whole)) + float(int(decimals or '0')) * _POW10[len(decimals)]) * (-1.0 if sign else 1.0)
+    if exponent:
+        result *= 10.0 ** int(exponent)
+    return result
+
+
+def _infer_column(values, types):
+    # pandas' read_json gives each column of a chunk one dtype, then tries to cast it to float64 and, when
+    # that's lossless, to int64: numbers next to nulls become floats, numeric strings become numbers.
+    if types == {int} or types == {bool} or types == {type(None)}:
+        return None
+    if float in types:
+        values = [_pandas_float(value) if type(value) is float else value for value in values]
+    try:
+        floats = [math.nan if value is None else float(value) for value in values]
+    except (TypeError, ValueError, OverflowError):
+        return values if float in types else None
+    try:
+        ints = [int(value) for value in values]
+    except (TypeError, ValueError, OverflowError):
+        return [None if value != value else value for value in floats]
+    if ints == floats and all(-2 ** 63 <= value < 2 ** 63 for value in ints):
+        return ints
+    return floats
+
+
+def _align_columns(records, fields):
+    """Mirror pandas' per-chunk dtypes so the output matches the pandas path. Returns the fields that may hold floats."""
+    float_fields = []
+    for field in fields:
+        column = [record[field] for record in records]
+        types = set(map(type, column))
+        values = _infer_column(column, types)
+        if values is not None:
+            for record, value in zip(records, values):
+                record[field] = value
+            types = set(map(type, values))
+        if types & {float, dict, list}:
+            float_fields.append(field)
+    return float_fields
+
+
+def _format_float(value):
+    # pandas' to_json (ujson, double_precision=10): 10 decimal places without the trailing zeros,
+    # '%.10g' outside of [1e-15, 1e16], and null for nan and infinity
+    if value != value or value in (math.inf, -math.inf):
+        return b'null'
+    magnitude = abs(value)
+    if magnitude > 1e16 or (magnitude and magnitude < 1e-15):
+        return b'%.10g' % value
+    whole = int(magnitude)
+    scaled = (magnitude - whole) * 1e10
+    fraction = int(scaled)
+    rest = scaled - fraction
+    if rest > 0.5 or (rest == 0.5 and (fraction == 0 or fraction & 1)):
+        fraction += 1
+    if fraction >= 10 ** 10:
+        whole, fraction = whole + 1, 0
+    decimals = f"{fraction:010d}".rstrip('0') if fraction else '0'
+    return f"{'-' if value < 0 else ''}{whole}.{decimals}".encode()
+
+
+def _has_float(value):
+    if type(value) is float:
+        return True
+    if type(value) is dict:
+        return any(map(_has_float, value.values()))
+    if type(value) is list:
+        return any(map(_has_float, value))
+    return False
+
+
+def _dump_value(value):
+    # Floats nested in objects and arrays, as pandas reads and writes them
+    if type(value) is float:
+        return _format_float(_pandas_float(value))
+    if type(value) is dict and _has_float(value):
+        return b'{' + b','.join(_dumps(key) + b':' + _dump_value(item) for key, item in value.items()) + b'}'
+    if type(value) is list and _has_float(value):
+        return b'[' + b','.join(map(_dump_value, value)) + b']'
+    return _dumps(value)
+
+
+def dump_record(record, float_fields=None):
+    """Serialize a projected record the way pandas' to_json(force_ascii=False) does, as utf-8 bytes.
+
+    Only the `float_fields` (by default all of them) are looked at for floats to round.
+    """
+    rounded = {}
+    for field in record if float_fields is None else float_fields:
+        value = record[field]
+        if type(value) is float:
+            # Most rounded floats print the same with orjson, which is much faster than joining the fields
+            text = _format_float(value)
+            value = None if text == b'null' else float(text)
+            if _dumps(value) != text:
+                break
+            rounded[field] = value
+        elif type(value) in (dict, list) and _has_float(value):
+            break
+    else:
+        projected = _dumps({**record, **rounded} if rounded else record)
+        # pandas' to_json escapes forward slashes, keep the output identical to the chunked path
+        return projected.replace(b'/', b'\\/')
+    # The columns' floats are already read the pandas way, the nested ones aren't
+    projected = b'{' + b','.join(_dumps(key) + b':' + (_format_float(value) if type(value) is float else _dump_value(value))
+                                 for key, value in record.items()) + b'}'
+    return projected.replace(b'/', b'\\/')
+
+
+def project_line(line, fields):
+    """Project a single raw json line onto `fields`, returned as bytes without the trailing newline."""
+    records = [project_record(line, fields)]
+    return dump_record(records[0], _align_columns(records, fields))
+
+
+def filter_fields(lines, output_jsonl, fields, chunk_size=10000, append=False):
+    """Project every line of `lines` onto `fields` and write (or append) the result to `output_jsonl`.
+
+    Lines are handled in chunks of `chunk_size` only to reproduce pandas' per-chunk dtypes.
+    """
+    metrics = active()
+    records = metrics.wrap(map(loads, metrics.wrap(lines, "read")), "parse")
+    with open(output_jsonl, 'ab' if append else 'wb') as out_file, metrics.phase("project"):
+        chunk = []
+        for record in records:
+            chunk.append({field: record.get(field) for field in fields})
+            if len(chunk) == chunk_size:
+                _write_chunk(out_file, chunk, fields, metrics)
+                chunk = []
+        if chunk:
+            _write_chunk(out_file, chunk, fields, metrics)
+
+
+def _write_chunk(out_file, records, fields, metrics):
+    with metrics.phase("serialize"):
+        data = _serialize_chunk(records, fields)
+    with metrics.phase("write"):
+        out_file.write(data)
+
+
+def _serialize_chunk(records, fields):
+    float_fields = _align_columns(records, fields)
+    return b''.join(dump_record(record, float_fields) + b'\n' for record in records)
+
+
+def estimate_partitions(file_path, max_memory, record_bytes, max_partitions=1024, sample_bytes=2 ** 20):
+    """Number of partitions of `file_path` such that one partition of records costing `record_bytes` each
+    in memory fits in `max_memory`; the record count is estimated from the average line of the first megabyte."""
+    total_bytes = os.path.getsize(file_path)
+    if not max_memory or not total_bytes:
+        return 1
+    with open(file_path, 'rb') as file:
+        sample = file.readlines(sample_bytes)
+    average_line = sum(map(len, sample)) / max(len(sample), 1)
+    estimated_bytes = total_bytes / average_line * record_bytes
+    return min(max_partitions, max(1, math.ceil(estimated_bytes / max_memory)))
+
+
+def split_byte_ranges(input_jsonl, num_ranges):
+    """Split a json lines file into `num_ranges` contiguous (start, end) byte ranges aligned on line starts."""
+    total_bytes = os.path.getsize(input_jsonl)
+    boundaries = [0]
+    with open(input_jsonl, 'rb') as file:
+        for i in range(1, num_ranges):
+            file.seek(max(total_bytes * i // num_ranges, boundaries[-1]))
+            if file.tell() > 0:
+                file.readline()  # move to the start of the next line
+            boundaries.append(min(file.tell(), total_bytes))
+    boundaries.append(total_bytes)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+def iter_range_lines(input_jsonl, start, end):
+    """Yield the non-empty lines (bytes) between two line-aligned byte offsets."""
+    with open(input_jsonl, 'rb') as file:
+        file.seek(start)
+        position = start
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            if line.strip():
+                yield line
+
+
+def _filter_range(task):
+    input_jsonl, start, end, part_path, fields, chunk_size = task
+    filter_fields(iter_range_lines(input_jsonl, start, end), part_path, fields, chunk_size)
+    return end - start, worker_timings()
+
+
+def filter_fields_parallel(input_jsonl, output_jsonl, fields, workers, chunk_size=10000, shards=False, range_size=256 * 2 ** 20):
+    """Project `input_jsonl` onto `fields` with a pool of `workers` processes.
+
+    The file is split into newline-aligned byte ranges of about `range_size` bytes, each projected into its own
+    part file. The parts are then concatenated in order into `output_jsonl`, or, with `shards=True`, the file is
+    split into exactly `workers` ranges kept as shard files listed in order in `<output_jsonl>.manifest.json`.
+    Dtype coercions that mirror pandas (see filter_fields) restart at every range boundary.
+    """
+    total_bytes = os.path.getsize(input_jsonl)
+    ranges = split_byte_ranges(input_jsonl, workers if shards else max(workers, -(-total_bytes // range_size)))
+    parts_dir = f"{output_jsonl}.parts"
+    # Shards of a previous run
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    if os.path.exists(f"{output_jsonl}.manifest.json"):
+        os.remove(f"{output_jsonl}.manifest.json")
+    os.makedirs(parts_dir)
+    part_paths = [os.path.join(parts_dir, f"part-{i:05d}.jsonl") for i in range(len(ranges))]
+    tasks = [(input_jsonl, start, end, part_path, fields, chunk_size) for (start, end), part_path in zip(ranges, part_paths)]
+
+    metrics = active()
+    keep_parts = False
+    try:
+        with multiprocessing.Pool(workers, initializer=init_worker, initargs=(metrics.enabled,)) as pool, metrics.phase("project"), \
+                tqdm(total=total_bytes, desc="Processing", unit="B", unit_scale=True) as pbar:
+            for done_bytes, timings in pool.imap_unordered(_filter_range, tasks):
+                pbar.update(done_bytes)
+                metrics.count(nbytes=done_bytes)
+                metrics.add_workers(timings)
+
+        if shards:
+            manifest = {
+                "input": input_jsonl,
+                "fields": fields,
+                "shards": [
+                    {"path": os.path.relpath(part_path, os.path.dirname(os.path.abspath(output_jsonl))), "start": start, "end": end}
+                    for (start, end), part_path in zip(ranges, part_paths)
+                ],
+            }
+            with open(f"{output_jsonl}.manifest.json", 'w', encoding='utf-8') as manifest_file:
+                json.dump(manifest, manifest_file, indent=2)
+            keep_parts = True
+            return
+
+        with open(output_jsonl, 'wb') as out_file, metrics.phase("write"):
+            for part_path in part_paths:
+                with open(part_path, 'rb') as part:
+                    shutil.copyfileobj(part, out_file, ZST_READ_SIZE)
+                os.remove(part_path)
+    finally:
+        # The parts are temporary unless they are the shards, also when a worker fails
+        if not keep_parts:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+
+
+def _project_chunk(task):
+    lines, fields = task
+    metrics = active()
+    with metrics.phase("project"):
+        records = [project_record(line, fields) for line in lines]
+    with metrics.phase("serialize"):
+        data = _serialize_chunk(records, fields)
+    return data, worker_timings()
+
+
+def _iter_chunks(lines, fields, chunk_size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk, fields
+            chunk = []
+    if chunk:
+        yield chunk, fields
+
+
+def filter_fields_parallel_stream(lines, output_jsonl, fields, workers, chunk_size=10000):
+    """Like filter_fields, but project chunks of `lines` in a pool of `workers` processes.
+
+    Used for .zst dumps, which can't be split by byte offset: the main process decompresses and the
+    workers parse and serialize. Chunks are written back in their original order.
+    """
+    metrics = active()
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(metrics.enabled,)) as pool, open(output_jsonl, 'wb') as out_file:
+        # The main process only reads and writes, the workers parse, project and serialize
+        for projected, timings in metrics.wrap(pool.imap(_project_chunk, _iter_chunks(metrics.wrap(lines, "read"), fields, chunk_size)), "project"):
+            metrics.add_workers(timings)
+            with metrics.phase("write"):
+                out_file.write(projected)
@@ -1,47 +1,127 @@
 import pandas as pd
 import os
 import argparse
-from tqdm import tqdm
-
-def convert_json_to_jsonl(input_json, output_jsonl, chunk_size=10000):
-    # Define the necessary fields to keep for submissions
-    submission_fields_to_keep = [
-        "id", "subreddit", "subreddit_id", "title", "selftext", "url", "permalink",
-        "created_utc", "score", "num_comments", "ups", "downs", "author",
-        "author_flair_text", "is_self", "domain", "over_18", "media", "edited",
-        "stickied", "distinguished"
-    ]
-    
-    # Estimate total lines for progress bar
-    total_lines = sum(1 for _ in open(input_json, 'r', encoding='utf-8'))
-    num_chunks = total_lines // chunk_size + 1
-    print(f"Total lines: {total_lines}, processing in chunks of {chunk_size} lines")
+from stream_utils import ProgressReader, iter_lines, iter_zst_lines, filter_fields, filter_fields_parallel, filter_fields_parallel_stream, read_watermark, write_watermark, check_watermark, input_fingerprint
+from parquet_utils import write_parquet_dataset
+from dedup import dedup_jsonl
+from metrics import active, add_metrics_args, instrument
+
+# Define the necessary fields to keep
+submission_fields_to_keep = [
+    "id", "subreddit", "subreddit_id", "title", "selftext", "url", "permalink",
+    "created_utc", "score", "num_comments", "ups", "downs", "author",
+    "author_flair_text", "is_self", "domain", "over_18", "media", "edited",
+    "stickied", "distinguished"
+]
+
+def convert_json_to_jsonl_pandas(input_json, output_jsonl, chunk_size=10000):
+    # Reference implementation: pandas DataFrame round-trip per chunk
+
+    metrics = active()
+    print(f"Processing in chunks of {chunk_size} lines")
     
-    # Process the JSON file in chunks using pandas' read_json with chunksize
+    # Process the JSON file in chunks using pandas' read_json with chunksize, the progress bar follows the bytes read
     try:
-        with tqdm(total=num_chunks, desc="Processing", unit="chunk") as pbar, open(output_jsonl, 'w', encoding='utf-8') as out_file:
-            for chunk in pd.read_json(input_json, lines=True, chunksize=chunk_size):
-                # Ensure all required fields exist in the chunk, filling missing ones with None
-                for field in submission_fields_to_keep:
-                    if field not in chunk.columns:
-                        chunk[field] = None
-                
-                # Filter the chunk to keep only the necessary fields
-                chunk_filtered = chunk[submission_fields_to_keep]
+        with ProgressReader(input_json) as reader, open(output_jsonl, 'w', encoding='utf-8') as out_file:
+            for chunk in metrics.wrap(pd.read_json(reader, lines=True, chunksize=chunk_size), "parse"):
+                with metrics.phase("project"):
+                    # Ensure all required fields exist in the chunk, filling missing ones with None
+                    for field in submission_fields_to_keep:
+                        if field not in chunk.columns:
+                            chunk[field] = None
+                    
+                    # Filter the chunk to keep only the necessary fields
+                    chunk_filtered = chunk[submission_fields_to_keep]
                 
                 # Write to JSONL file (each row as a separate JSON object)
-                chunk_filtered.to_json(out_file, orient='records', lines=True, force_ascii=False)
-                
-                pbar.update(1)
+                with metrics.phase("write"):
+                    chunk_filtered.to_json(out_file, orient='records', lines=True, force_ascii=False)
     except Exception as e:
         print(f"Error processing file: {e}")
     
     print(f"JSONL file saved at: {output_jsonl}")
 
+def convert_json_to_jsonl(input_json, output_jsonl, chunk_size=10000, workers=1, shards=False):
+    # Project each line on its own, without building a DataFrame
+    if workers > 1:
+        filter_fields_parallel(input_json, output_jsonl, submission_fields_to_keep, workers, chunk_size, shards)
+    else:
+        filter_fields(iter_lines(input_json), output_jsonl, submission_fields_to_keep, chunk_size)
+    print(f"JSONL file saved at: {output_jsonl}")
+
+def convert_zst_to_jsonl(input_zst, output_jsonl, chunk_size=10000, workers=1):
+    # Stream the compressed dump and project each line, without a decompressed intermediate file
+    if workers > 1:
+        filter_fields_parallel_stream(iter_zst_lines(input_zst), output_jsonl, submission_fields_to_keep, workers, chunk_size)
+    else:
+        filter_fields(iter_zst_lines(input_zst), output_jsonl, submission_fields_to_keep, chunk_size)
+    print(f"JSONL file saved at: {output_jsonl}")
+
+def convert_incremental(input_path, output_jsonl, state_file, chunk_size=10000):
+    # Only project the lines appended to the raw dump since the last run, and append them to the JSONL
+    key = f"filter:{os.path.basename(input_path)}"
+    watermark = read_watermark(state_file, key)
+    start = watermark.get("offset", 0)
+
+    # Drop whatever an interrupted run appended after the last recorded output size
+    with open(output_jsonl, 'ab') as out_file:
+        out_file.truncate(watermark.get("output_size", 0))
+
+    if input_path.endswith('.zst'):
+        consumed = {}
+        filter_fields(iter_zst_lines(input_path, start=start, consumed=consumed, start_fingerprint=watermark.get("fingerprint")), output_jsonl, submission_fields_to_keep, chunk_size, append=True)
+        end = consumed['bytes']
+        if end < start:
+            raise ValueError(f"{input_path} is smaller than its watermark ({start} bytes), it was rewritten: rerun without --incremental")
+        fingerprint = {"fingerprint": consumed['fingerprint']}
+    else:
+        check_watermark(input_path, watermark)
+        consumed = {}
+        filter_fields(iter_lines(input_path, start=start, end=os.path.getsize(input_path), consumed=consumed), output_jsonl, submission_fields_to_keep, chunk_size, append=True)
+        end = consumed['bytes']
+        fingerprint = input_fingerprint(input_path, end)
+
+    write_watermark(state_file, key, end, output_size=os.path.getsize(output_jsonl), **fingerprint)
+    print(f"Processed bytes {start}-{end} of {input_path}, JSONL file updated at: {output_jsonl}")
+
+def convert_to_parquet(lines, output_dir):
+    # Columnar copy of the cleaned data, partitioned by month of created_utc
+    write_parquet_dataset(lines, output_dir, submission_fields_to_keep)
+    print(f"Parquet dataset saved at: {output_dir}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert JSON submissions file to JSONL with necessary fields.")
     parser.add_argument('folder', type=str, help='Path to the input folder')
     parser.add_argument("--chunk_size", type=int, default=10000, help="Number of lines to process in each chunk")
+    parser.add_argument("--zst", action="store_true", help="Stream the raw .zst dump directly instead of the decompressed file")
+    parser.add_argument("--engine", choices=["projector", "pandas"], default="projector", help="Line-level projector (default) or the reference pandas chunk path")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used by the projector (default: 1, single process)")
+    parser.add_argument("--parquet", action="store_true", help="Write a Parquet dataset partitioned by month (<folder>_submissions.parquet) instead of JSONL")
+    parser.add_argument("--incremental", action="store_true", help="Only process the lines added since the last --incremental run (watermarks in <folder>_watermarks.json)")
+    parser.add_argument("--shards", action="store_true", help="With --workers N, split the input into N byte ranges and keep one output shard per range plus a manifest, instead of writing the single ordered .jsonl file the later stages read")
+    parser.add_argument("--dedup", action="store_true", help="Then drop the records whose id appears again, keeping the one with the latest retrieved_on")
     
+    add_metrics_args(parser)
     args = parser.parse_args()
-    convert_json_to_jsonl(f'{args.folder}/{args.folder}_submissions', f'{args.folder}/{args.folder}_submissions.jsonl', args.chunk_size)
+    if args.shards and (args.workers < 2 or args.zst or args.incremental or args.parquet or args.engine == "pandas"):
+        parser.error("--shards only applies to --workers over the decompressed dump, it can't be combined with --zst, --incremental, --parquet or --engine pandas")
+    if args.dedup and (args.incremental or args.parquet or args.shards):
+        parser.error("--dedup rewrites the whole JSONL file, it can't be combined with --incremental, --parquet or --shards")
+    if args.incremental and (args.workers > 1 or args.parquet or args.engine == "pandas"):
+        parser.error("--incremental projects the appended lines in one process, it can't be combined with --workers, --parquet or --engine pandas")
+    with instrument("filter-submissions", args.metrics, args.profile):
+        if args.incremental:
+            input_path = f'{args.folder}/{args.folder}_submissions' + ('.zst' if args.zst else '')
+            convert_incremental(input_path, f'{args.folder}/{args.folder}_submissions.jsonl', f'{args.folder}/{args.folder}_watermarks.json', args.chunk_size)
+        elif args.parquet:
+            input_path = f'{args.folder}/{args.folder}_submissions' + ('.zst' if args.zst else '')
+            convert_to_parquet(iter_zst_lines(input_path) if args.zst else iter_lines(input_path), f'{args.folder}/{args.folder}_submissions.parquet')
+        elif args.zst:
+            convert_zst_to_jsonl(f'{args.folder}/{args.folder}_submissions.zst', f'{args.folder}/{args.folder}_submissions.jsonl', args.chunk_size, args.workers)
+        elif args.engine == "pandas":
+            convert_json_to_jsonl_pandas(f'{args.folder}/{args.folder}_submissions', f'{args.folder}/{args.folder}_submissions.jsonl', args.chunk_size)
+        else:
+            convert_json_to_jsonl(f'{args.folder}/{args.folder}_submissions', f'{args.folder}/{args.folder}_submissions.jsonl', args.chunk_size, args.workers, args.shards)
+        if args.dedup:
+            kept, dropped = dedup_jsonl(f'{args.folder}/{args.folder}_submissions.jsonl')
+            print(f"Dropped {dropped} duplicate submissions, {kept} left")
@@ -1,12 +1,15 @@
 import sqlite3
 import json
 import argparse
-from tqdm import tqdm
+from schema import SUBMISSION_SCHEMA
+from dedup import reddit_id_to_int
+from db_utils import add_pragma_args, apply_pragmas, load_jsonl, create_indexes, create_fts_index, id_columns, uses_integer_ids, POSTS_INDEXES
+from metrics import add_metrics_args, instrument
 
-def create_table(cursor):
-    cursor.execute("""
+def create_table(cursor, integer_ids=False):
+    cursor.execute(f"""
         CREATE TABLE IF NOT EXISTS posts (
-            id TEXT PRIMARY KEY,
+            {id_columns(integer_ids)},
             subreddit TEXT,
             subreddit_id TEXT,
             title TEXT,
@@ -30,57 +33,89 @@ def create_table(cursor):
         )
     """)
 
-def insert_data(cursor, jsonl_file):
-    with open(jsonl_file, "r", encoding="utf-8") as file:
-        lines = file.readlines()
-        for line in tqdm(lines, desc="Inserting posts"):
-            post = json.loads(line.strip())
-            cursor.execute("""
-                INSERT OR IGNORE INTO posts (
-                    id, subreddit, subreddit_id, title, selftext, url, permalink,
-                    created_utc, score, num_comments, ups, downs, author, author_flair_text,
-                    is_self, domain, over_18, media, edited, stickied, distinguished
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                post.get("id", "unknown"),
-                post.get("subreddit", "unknown"),
-                post.get("subreddit_id", "unknown"),
-                post.get("title", "unknown"),
-                post.get("selftext", ""),
-                post.get("url", "unknown"),
-                post.get("permalink", "unknown"),
-                post.get("created_utc", -1),
-                post.get("score", -1),
-                post.get("num_comments", -1),
-                post.get("ups", -1.0),
-                post.get("downs", -1.0),
-                post.get("author", "unknown"),
-                post.get("author_flair_text", "unknown"),
-                int(post.get("is_self", False)),
-                post.get("domain", "unknown"),
-                int(post.get("over_18", False)),
-                json.dumps(post.get("media")) if post.get("media") else "unknown",
-                int(post.get("edited", -1)),
-                int(post["stickied"]) if post.get("stickied") is not None else -1,
-                post.get("distinguished", "unknown")
-            ))
+INSERT_SQL = """
+    INSERT OR IGNORE INTO posts (
+        id, subreddit, subreddit_id, title, selftext, url, permalink,
+        created_utc, score, num_comments, ups, downs, author, author_flair_text,
+        is_self, domain, over_18, media, edited, stickied, distinguished
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def post_row(post):
+    # Missing fields get the placeholders the table has always had ("unknown", "", -1), the queries rely on them.
+    # A null is_self, over_18 or edited gets the placeholder of a missing one.
+    get = post.get
+    media = get("media")
+    edited = get("edited")
+    stickied = get("stickied")
+    return (
+        get("id", "unknown"),
+        get("subreddit", "unknown"),
+        get("subreddit_id", "unknown"),
+        get("title", "unknown"),
+        get("selftext", ""),
+        get("url", "unknown"),
+        get("permalink", "unknown"),
+        get("created_utc", -1),
+        get("score", -1),
+        get("num_comments", -1),
+        get("ups", -1.0),
+        get("downs", -1.0),
+        get("author", "unknown"),
+        get("author_flair_text", "unknown"),
+        int(get("is_self") or False),
+        get("domain", "unknown"),
+        int(get("over_18") or False),
+        json.dumps(media) if media else "unknown",
+        int(edited) if edited is not None else -1,
+        int(stickied) if stickied is not None else -1,
+        get("distinguished", "unknown")
+    )
+
+INTEGER_IDS_INSERT_SQL = f"""
+    INSERT OR IGNORE INTO posts (id_int, {", ".join(SUBMISSION_SCHEMA.fields)})
+    VALUES ({", ".join("?" * (len(SUBMISSION_SCHEMA.fields) + 1))})
+"""
+
+def integer_id_post_row(post):
+    id_int = reddit_id_to_int(post.get("id"))
+    return None if id_int is None else (id_int,) + post_row(post)
+
+def insert_data(conn, jsonl_file, batch_size=10000, resume=True, integer_ids=False):
+    # Streaming, batched load: rows are built in a worker process and each batch is
+    # committed with a byte-offset checkpoint, so an interrupted load resumes where it stopped
+    if integer_ids:
+        load_jsonl(conn, INTEGER_IDS_INSERT_SQL, jsonl_file, integer_id_post_row, batch_size, resume)
+    else:
+        load_jsonl(conn, INSERT_SQL, jsonl_file, post_row, batch_size, resume)
 
 def main():
     parser = argparse.ArgumentParser(description="Insert JSONL data into a SQLite database.")
     parser.add_argument("folder", type=str, help="Folder containing the JSONL data files")
+    parser.add_argument("--fts", action="store_true", help="Also build the full-text index over title and selftext (posts_fts) after the load")
+    parser.add_argument("--from_start", action="store_true", help="Ignore the resume checkpoint and read the file from the beginning")
+    parser.add_argument("--integer_ids", action="store_true", help="Key a new table by the base-36 id as an integer (id_int INTEGER PRIMARY KEY), for files deduplicated with --dedup or dedup-jsonl.py")
+    add_pragma_args(parser)
+    add_metrics_args(parser)
     args = parser.parse_args()
 
-    conn = sqlite3.connect(f"{args.folder}/{args.folder}_submissions.db")
-    cursor = conn.cursor()
+    with instrument("submissions-db", args.metrics, args.profile):
+        conn = sqlite3.connect(f"{args.folder}/{args.folder}_submissions.db")
+        cursor = conn.cursor()
 
-    create_table(cursor)
-    insert_data(cursor, f"{args.folder}/{args.folder}_submissions.jsonl")
+        apply_pragmas(cursor, args.journal_mode, args.synchronous, args.cache_size)
+        create_table(cursor, args.integer_ids)
+        if uses_integer_ids(cursor, "posts") != args.integer_ids:
+            parser.error(f"the posts table already exists {'without' if args.integer_ids else 'with'} integer ids, rerun {'without' if args.integer_ids else 'with'} --integer_ids")
+        insert_data(conn, f"{args.folder}/{args.folder}_submissions.jsonl", args.batch_size, not args.from_start, args.integer_ids)
+        create_indexes(conn, POSTS_INDEXES)
+        if args.fts:
+            create_fts_index(conn, "posts")
 
-    conn.commit()
-    conn.close()
+        conn.close()
 
-    print("Data successfully inserted into the database.")
+        print("Data successfully inserted into the database.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,212 @@
+import os
+import json
+import shutil
+import tempfile
+from tqdm import tqdm
+from distinct import link_id_to_int
+from stream_utils import iter_lines, loads, estimate_partitions
+from schema import column_decoder
+from metrics import active
+
+# Rough in-memory cost of one comment while its partition is being linked into threads
+COMMENT_BYTES = 400
+# Shuffled lines buffered before they are appended to their partition files, one file open at a time, so
+# that the number of partitions isn't bounded by the open file limit
+_FLUSH_BYTES = 2 ** 25
+
+
+def _clean(value):
+    return "" if value is None else str(value).replace('\t', ' ').replace('\n', ' ')
+
+
+def _number(value):
+    return int(float(value)) if value else None
+
+
+def shuffle_by_link(file_path, tmp_dir, partitions):
+    """Pass 1: stream the comments and append the thread fields of each to the partition file of its link_id.
+
+    Every comment of a post lands in the same partition, so a partition can be linked on its own.
+    """
+    paths = [os.path.join(tmp_dir, f"part-{partition:04d}.tsv") for partition in range(partitions)]
+    buffers = [[] for _ in range(partitions)]
+    buffered_bytes = 0
+    decode = column_decoder(["link_id", "id", "parent_id", "author", "created_utc", "score"])
+    count = 0
+
+    def flush():
+        for path, buffer in zip(paths, buffers):
+            with open(path, 'a', encoding='utf-8') as file:
+                file.writelines(buffer)
+            buffer.clear()
+
+    for line in iter_lines(file_path, desc="Shuffling comments"):
+        link_id, comment_id, parent_id, author, created_utc, score = decode(loads(line))
+        if not link_id or not comment_id:
+            continue
+        row = f"{link_id}\t{_clean(comment_id)}\t{_clean(parent_id)}\t{_clean(author)}\t{_clean(created_utc)}\t{_clean(score)}\n"
+        buffers[link_id_to_int(link_id) % partitions].append(row)
+        buffered_bytes += len(row)
+        count += 1
+        if buffered_bytes >= _FLUSH_BYTES:
+            flush()
+            buffered_bytes = 0
+    flush()
+    return paths, count
+
+
+def _read_partition(path):
+    # {link_id: [(id, parent_id, author, created_utc, score), ...]}, a comment repeated in the dump is kept once
+    posts = {}
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            link_id, comment_id, parent_id, author, created_utc, score = line.rstrip('\n').split('\t')
+            comments = posts.setdefault(link_id, {})
+            if comment_id not in comments:
+                comments[comment_id] = (comment_id, parent_id, author, created_utc, score)
+    return {link_id: list(comments.values()) for link_id, comments in posts.items()}
+
+
+def _cycle_members(unreached, parent_of):
+    # The comments on a reply cycle, among those never reached from a top-level comment
+    members = set()
+    state = {}
+    for start in unreached:
+        path = []
+        comment_id = start
+        while comment_id not in state:
+            state[comment_id] = start
+            path.append(comment_id)
+            comment_id = parent_of[comment_id]
+        if state[comment_id] == start:
+            # The walk came back to a comment of its own path: the rest of the path from there is the cycle
+            members.update(path[path.index(comment_id):])
+    return members
+
+
+def link_thread(link_id, comments):
+    """Link the comments of one post through parent_id.
+
+    Returns (roots, children, depth, descendants, orphans): top-level comment ids, child ids per comment id,
+    the depth (1 for top-level) and number of replies below each comment, and the number of orphans:
+    comments whose parent comment is missing from the dump (e.g. removed) or is in a reply cycle, which are
+    treated as top-level. The comments in reply cycles are the only ones left without a depth.
+    """
+    ids = {comment[0] for comment in comments}
+    children = {}
+    parent_of = {}
+    roots = []
+    orphans = 0
+    # Children in creation order
+    ordered = sorted(comments, key=lambda comment: (_number(comment[3]) or 0, comment[0]))
+    for comment_id, parent_id, _, _, _ in ordered:
+        parent_kind, _, parent = parent_id.partition('_')
+        if parent_kind == "t1" and parent in ids and parent != comment_id:
+            children.setdefault(parent, []).append(comment_id)
+            parent_of[comment_id] = parent
+        else:
+            if parent_kind == "t1" or (parent_kind == "t3" and parent_id != link_id):
+                orphans += 1
+            roots.append(comment_id)
+
+    # Breadth-first from the roots, iteratively: threads can be thousands of levels deep
+    depth = {comment_id: 1 for comment_id in roots}
+    order = list(roots)
+
+    def walk(index):
+        while index < len(order):
+            comment_id = order[index]
+            for child in children.get(comment_id, ()):
+                if child not in depth:
+                    depth[child] = depth[comment_id] + 1
+                    order.append(child)
+            index += 1
+
+    walk(0)
+    if len(depth) < len(ids):
+        # Comments replying to a cycle become top-level, so only the cycle itself stays out of the tree
+        in_cycle = _cycle_members([comment[0] for comment in ordered if comment[0] not in depth], parent_of)
+        start = len(order)
+        for comment_id, _, _, _, _ in ordered:
+            if comment_id not in in_cycle and parent_of.get(comment_id) in in_cycle:
+                children[parent_of[comment_id]].remove(comment_id)
+                orphans += 1
+                roots.append(comment_id)
+                depth[comment_id] = 1
+                order.append(comment_id)
+        walk(start)
+    descendants = dict.fromkeys(order, 0)
+    for comment_id in reversed(order):
+        for child in children.get(comment_id, ()):
+            if child in descendants:
+                descendants[comment_id] += descendants[child] + 1
+    return roots, children, depth, descendants, orphans
+
+
+def _tree(comment_id, info, children):
+    # Nested dict of one comment and its replies, built without recursion
+    root = dict(info[comment_id], replies=[])
+    stack = [(comment_id, root)]
+    while stack:
+        parent, node = stack.pop()
+        for child in children.get(parent, ()):
+            child_node = dict(info[child], replies=[])
+            node["replies"].append(child_node)
+            stack.append((child, child_node))
+    return root
+
+
+def build_threads(file_path, posts_output, comments_output=None, trees_output=None, max_memory=None, partitions=None):
+    """Rebuild the comment threads of a cleaned comments file within a memory budget.
+
+    Comments are shuffled into on-disk partitions by link_id, then each partition is linked on its own.
+    Writes per-post thread features to `posts_output` and, optionally, per-comment depth and reply counts
+    to `comments_output` and nested JSON trees (one post per line) to `trees_output`. A comment id repeated
+    within a post is linked once. Comments in reply cycles (a comment that is, through its parents, a reply
+    to itself) can't be placed in a tree: they are counted per post but left out of the depths, the comment
+    rows and the trees, and the replies to them are treated as orphans.
+    Returns the number of comments processed and the number of comments in reply cycles.
+    """
+    partitions = partitions or estimate_partitions(file_path, max_memory, COMMENT_BYTES)
+    metrics = active()
+    tmp_dir = tempfile.mkdtemp(prefix="threads-", dir=os.path.dirname(os.path.abspath(file_path)))
+    try:
+        with metrics.phase("shuffle"):
+            paths, count = shuffle_by_link(file_path, tmp_dir, partitions)
+        in_cycles = 0
+
+        # Pass 2: one partition in memory at a time
+        posts_file = open(posts_output, 'w', encoding='utf-8')
+        comments_file = open(comments_output, 'w', encoding='utf-8') if comments_output else None
+        trees_file = open(trees_output, 'w', encoding='utf-8') if trees_output else None
+        try:
+            posts_file.write("link_id\tnum_comments\tnum_top_level\tmax_depth\tnum_authors\tnum_orphans\tnum_in_cycles\n")
+            if comments_file:
+                comments_file.write("id\tlink_id\tparent_id\tdepth\tnum_replies\tnum_descendants\n")
+            with metrics.phase("link"):
+                for path in tqdm(paths, desc="Linking threads", unit=" partitions"):
+                    for link_id, comments in sorted(_read_partition(path).items()):
+                        roots, children, depth, descendants, orphans = link_thread(link_id, comments)
+                        authors = {comment[2] for comment in comments if comment[2] and comment[2] != "[deleted]"}
+                        # Comments never reached from a top-level comment are the ones in reply cycles
+                        cycles = len(comments) - len(depth)
+                        in_cycles += cycles
+                        posts_file.write(f"{link_id}\t{len(comments)}\t{len(roots)}\t{max(depth.values(), default=0)}\t{len(authors)}\t{orphans}\t{cycles}\n")
+                        if comments_file:
+                            for comment_id, parent_id, _, _, _ in comments:
+                                if comment_id in depth:
+                                    comments_file.write(f"{comment_id}\t{link_id}\t{parent_id}\t{depth[comment_id]}\t{len(children.get(comment_id, ()))}\t{descendants[comment_id]}\n")
+                        if trees_file:
+                            info = {comment_id: {"id": comment_id, "author": author, "created_utc": _number(created_utc), "score": _number(score)}
+                                    for comment_id, _, author, created_utc, score in comments}
+                            trees_file.write(json.dumps({"link_id": link_id, "replies": [_tree(root, info, children) for root in roots]}, ensure_ascii=False) + "\n")
+                    os.remove(path)
+        finally:
+            posts_file.close()
+            if comments_file:
+                comments_file.close()
+            if trees_file:
+                trees_file.close()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return count, in_cycles
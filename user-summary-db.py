@@ -1,67 +1,79 @@
-import pandas as pd
+import os
+import csv
 import argparse
 import sqlite3
 from tqdm import tqdm
+from db_utils import create_indexes, COMMENTS_INDEXES, POSTS_INDEXES
+from metrics import add_metrics_args, instrument
+
+def merge_by_author(comment_rows, post_rows):
+    # Both inputs are sorted by author: merge-join them like a full outer join
+    comment_row = next(comment_rows, None)
+    post_row = next(post_rows, None)
+    while comment_row is not None or post_row is not None:
+        if post_row is None or (comment_row is not None and comment_row[0] < post_row[0]):
+            yield comment_row[0], comment_row[1], comment_row[2], 0
+            comment_row = next(comment_rows, None)
+        elif comment_row is None or post_row[0] < comment_row[0]:
+            yield post_row[0], 0, 0, post_row[1]
+            post_row = next(post_rows, None)
+        else:
+            yield comment_row[0], comment_row[1], comment_row[2], post_row[1]
+            comment_row = next(comment_rows, None)
+            post_row = next(post_rows, None)
 
 def main():
     parser = argparse.ArgumentParser(description="Generate user summary from Reddit data stored in SQLite databases.")
     parser.add_argument('folder', type=str, help="Folder containing SQLite databases")
+    add_metrics_args(parser)
     args = parser.parse_args()
 
-    folder = args.folder
-
-    # Connect to SQLite databases
-    comments_conn = sqlite3.connect(f'{folder}/{folder}_comments.db')
-    submissions_conn = sqlite3.connect(f'{folder}/{folder}_submissions.db')
-
-    comments_cursor = comments_conn.cursor()
-    submissions_cursor = submissions_conn.cursor()
-
-    # Extract unique users from both databases
-    comments_cursor.execute("SELECT DISTINCT author FROM comments")
-    submissions_cursor.execute("SELECT DISTINCT author FROM posts")
-
-    users_set = set(user[0] for user in comments_cursor.fetchall())
-    users_set.update(user[0] for user in submissions_cursor.fetchall())
-
-    # Get total counts
-    comments_cursor.execute("SELECT COUNT(*) FROM comments")
-    num_comments_total = comments_cursor.fetchone()[0]
-
-    submissions_cursor.execute("SELECT COUNT(*) FROM posts")
-    num_submissions_total = submissions_cursor.fetchone()[0]
-
-    # Initialize list to store user summaries
-    user_summaries = []
-
-    # Iterate through users with progress bar
-    for user in tqdm(users_set, desc="Processing Users"):
-        comments_cursor.execute("SELECT COUNT(*), COUNT(DISTINCT link_id) FROM comments WHERE author = ?", (user,))
-        num_comments, num_comments_unique_posts = comments_cursor.fetchone()
-
-        submissions_cursor.execute("SELECT COUNT(DISTINCT id) FROM posts WHERE author = ?", (user,))
-        num_posts_unique = submissions_cursor.fetchone()
-
-        # Append user summary to list
-        user_summaries.append({
-            'user': user,
-            'num_comments': num_comments,
-            'num_comments_unique_posts': num_comments_unique_posts,
-            'num_posts_unique': num_posts_unique
-        })
-
-    # Close database connections
-    comments_conn.close()
-    submissions_conn.close()
-
-    # Convert list to DataFrame
-    user_summary_df = pd.DataFrame(user_summaries)
-
-    # Include dataset sizes in the output file name
-    output_file = f'{folder}/user_summary_{num_comments_total}comments_{num_submissions_total}posts_{len(users_set)}users.tsv'
-    user_summary_df.to_csv(output_file, sep='\t', index=False)
-
-    print(f"User summary saved to {output_file}")
+    with instrument("user-summary-db", args.metrics, args.profile) as metrics:
+        folder = args.folder
+
+        # Connect to SQLite databases
+        comments_conn = sqlite3.connect(f'{folder}/{folder}_comments.db')
+        submissions_conn = sqlite3.connect(f'{folder}/{folder}_submissions.db')
+
+        # Databases loaded before the indexes existed get them now
+        create_indexes(comments_conn, COMMENTS_INDEXES)
+        create_indexes(submissions_conn, POSTS_INDEXES)
+
+        # Get total counts
+        num_comments_total = comments_conn.execute("SELECT COUNT(*) FROM comments").fetchone()[0]
+        num_submissions_total = submissions_conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+        # One GROUP BY per table, both answered from the covering (author, ...) indexes in author order
+        comment_rows = comments_conn.execute("""
+            SELECT author, COUNT(*), COUNT(DISTINCT link_id) FROM comments
+            WHERE author IS NOT NULL GROUP BY author ORDER BY author
+        """)
+        post_rows = submissions_conn.execute("""
+            SELECT author, COUNT(DISTINCT id) FROM posts
+            WHERE author IS NOT NULL GROUP BY author ORDER BY author
+        """)
+
+        # Stream the summary to a temporary file, the final name needs the number of users
+        tmp_file = f'{folder}/user_summary.tsv.tmp'
+        num_users = 0
+        with open(tmp_file, 'w', encoding='utf-8', newline='') as out_file, metrics.phase("write"):
+            writer = csv.writer(out_file, delimiter='\t', lineterminator='\n')
+            writer.writerow(['user', 'num_comments', 'num_comments_unique_posts', 'num_posts_unique'])
+            # The GROUP BY queries run as their rows are fetched
+            for row in metrics.wrap(tqdm(merge_by_author(comment_rows, post_rows), desc="Processing Users", unit=" users"), "query"):
+                writer.writerow(row)
+                num_users += 1
+        metrics.count(num_users)
+
+        # Close database connections
+        comments_conn.close()
+        submissions_conn.close()
+
+        # Include dataset sizes in the output file name
+        output_file = f'{folder}/user_summary_{num_comments_total}comments_{num_submissions_total}posts_{num_users}users.tsv'
+        os.replace(tmp_file, output_file)
+
+        print(f"User summary saved to {output_file}")
 
 if __name__ == "__main__":
     main()
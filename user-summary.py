@@ -1,64 +1,132 @@
+import os
+import numpy as np
 import pandas as pd
 import argparse
-from tqdm import tqdm  # Import tqdm for progress bar
+from stream_utils import iter_lines, loads
+from parquet_utils import iter_parquet_batches, open_parquet_dataset
+from metrics import active, add_metrics_args, instrument
+from encoding import MISSING, load_codes, read_names, count_per, distinct_per
 
-# Set up argument parser
-parser = argparse.ArgumentParser(description="Process user comments and submissions data.")
-parser.add_argument("folder", type=str, help="Folder containing the JSONL data files")
+def read_columns(file_path, columns, chunk_size=None):
+    """Yield DataFrames holding only `columns` of a json lines file, as categoricals.
 
-# Parse arguments
-args = parser.parse_args()
-folder = args.folder
+    The whole file is one DataFrame unless `chunk_size` is given.
+    """
+    data = {column: [] for column in columns}
+    for line in iter_lines(file_path, desc=f"Reading {os.path.basename(file_path)}"):
+        record = loads(line)
+        for column in columns:
+            data[column].append(record.get(column))
+        if chunk_size and len(data[columns[0]]) == chunk_size:
+            yield pd.DataFrame(data, dtype="category")
+            data = {column: [] for column in columns}
+    if data[columns[0]]:
+        yield pd.DataFrame(data, dtype="category")
 
-# Load data
-comments_file = f"{folder}/{folder}_comments.jsonl"
-submissions_file = f"{folder}/{folder}_submissions.jsonl"
+def read_parquet_columns(dataset_dir, columns, chunk_size=None):
+    """Like read_columns, from a Parquet dataset: only `columns` are read, dictionary columns come back as categoricals."""
+    if chunk_size:
+        for batch in iter_parquet_batches(dataset_dir, columns, chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield open_parquet_dataset(dataset_dir).to_table(columns=columns).to_pandas()
 
-comments_df = pd.read_json(comments_file, lines=True)
-submission_df = pd.read_json(submissions_file, lines=True)
+def aggregate(file_path, key, chunk_size=None, parquet=False):
+    """Rows per author and distinct `key` values per author, with partial aggregates merged across chunks."""
+    total_rows = 0
+    counts = pd.Series(dtype="int64")
+    pairs = [pd.DataFrame(columns=["author", key])]
+    compacted, pending = 0, 0
+    reader = read_parquet_columns if parquet else read_columns
+    metrics = active()
+    for chunk in metrics.wrap(reader(file_path, ["author", key], chunk_size), "read"):
+        with metrics.phase("aggregate"):
+            total_rows += len(chunk)
+            chunk_counts = chunk.groupby("author", observed=True).size()
+            chunk_counts.index = chunk_counts.index.astype(object)
+            counts = counts.add(chunk_counts, fill_value=0)
+            # Distinct (author, key) pairs are kept so that the distinct counts stay exact across chunks. They are
+            # deduplicated again only once the new pairs outnumber the deduplicated ones, so the work stays linear.
+            chunk_pairs = chunk.dropna().drop_duplicates().astype(object)
+            pairs.append(chunk_pairs)
+            pending += len(chunk_pairs)
+            if pending > compacted:
+                pairs = [pd.concat(pairs, ignore_index=True).drop_duplicates()]
+                compacted, pending = len(pairs[0]), 0
+    with metrics.phase("aggregate"):
+        unique = pd.concat(pairs, ignore_index=True).drop_duplicates().groupby("author").size()
+    return total_rows, counts.astype("int64"), unique
 
-# Extract unique users
-users_set = set()
-users_set.update(submission_df['author'].dropna())
-users_set.update(comments_df['author'].dropna())
+def aggregate_encoded(folder):
+    """The summary table from the integer codes saved by encode-ids.py: bincounts over the author codes."""
+    metrics = active()
+    with metrics.phase("read"):
+        names = read_names(f'{folder}/{folder}_authors.txt')
+        comment_authors, comment_links = load_codes(folder, "comments")
+        post_authors, post_ids = load_codes(folder, "submissions")
 
-# Get dataset sizes
-num_comments_total = len(comments_df)
-num_submissions_total = len(submission_df)
+    columns = {}
+    with metrics.phase("aggregate"):
+        for prefix, authors, links in (("num_comments", comment_authors, comment_links), ("num_posts", post_authors, post_ids)):
+            # Rows without an author are left out, like the groupby does; pairs without a link too
+            valid = authors != MISSING
+            columns[prefix] = count_per(authors[valid], len(names))
+            valid &= links != MISSING
+            columns[prefix + ("_unique_posts" if prefix == "num_comments" else "_unique")] = distinct_per(authors[valid], links[valid], len(names))
+        users = np.flatnonzero(columns["num_comments"] + columns["num_posts"])
+    metrics.count(len(comment_authors) + len(post_authors))
 
-print(f"Total comments: {num_comments_total}")
-print(f"Total submissions: {num_submissions_total}")
-print(f"Total users: {len(users_set)}")
+    user_summary_df = pd.DataFrame({column: counts[users] for column, counts in columns.items()})
+    user_summary_df.insert(0, 'user', [names[code] for code in users])
+    user_summary_df = user_summary_df.sort_values('user', kind='stable', ignore_index=True)
+    return len(comment_authors), len(post_authors), user_summary_df
 
-# Initialize list to store user summaries
-user_summaries = []
+def main():
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description="Process user comments and submissions data.")
+    parser.add_argument("folder", type=str, help="Folder containing the JSONL data files")
+    parser.add_argument("--chunk_size", type=int, default=None, help="Aggregate this many lines at a time and merge the partial results (default: whole file at once)")
+    parser.add_argument("--parquet", action="store_true", help="Read the <folder>_comments.parquet and <folder>_submissions.parquet datasets instead of the JSONL files")
+    parser.add_argument("--encoded", action="store_true", help="Aggregate the integer codes saved by encode-ids.py instead of reading the JSONL files")
+    add_metrics_args(parser)
+    args = parser.parse_args()
+    if args.encoded and (args.parquet or args.chunk_size):
+        parser.error("--encoded aggregates the codes, it can't be combined with --parquet or --chunk_size")
+    with instrument("user-summary", args.metrics, args.profile) as metrics:
+        folder = args.folder
 
-# Iterate through users with progress bar
-for user in tqdm(users_set, desc="Processing Users"):
-    user_comments = comments_df[comments_df['author'] == user]
-    num_comments = user_comments.shape[0]
-    num_comments_unique_posts = user_comments['link_id'].nunique()
+        if args.encoded:
+            num_comments_total, num_submissions_total, user_summary_df = aggregate_encoded(folder)
+        else:
+            extension = "parquet" if args.parquet else "jsonl"
+            comments_file = f"{folder}/{folder}_comments.{extension}"
+            submissions_file = f"{folder}/{folder}_submissions.{extension}"
 
-    user_posts = submission_df[submission_df['author'] == user]
-    num_posts = user_posts.shape[0]
-    num_posts_unique = user_posts['id'].nunique()
+            # One groupby pass per table over the author, link_id and id columns only
+            num_comments_total, num_comments, num_comments_unique_posts = aggregate(comments_file, "link_id", args.chunk_size, args.parquet)
+            num_submissions_total, num_posts, num_posts_unique = aggregate(submissions_file, "id", args.chunk_size, args.parquet)
 
-    # Append user summary to list
-    user_summaries.append({
-        'user': user,
-        'num_comments': num_comments,
-        'num_comments_unique_posts': num_comments_unique_posts,
-        'num_posts': num_posts,
-        'num_posts_unique': num_posts_unique
-    })
+            user_summary_df = pd.DataFrame({
+                'num_comments': num_comments,
+                'num_comments_unique_posts': num_comments_unique_posts,
+                'num_posts': num_posts,
+                'num_posts_unique': num_posts_unique,
+            }).fillna(0).astype(int)
+            user_summary_df.index.name = 'user'
+            user_summary_df = user_summary_df.reset_index()
 
-# Convert list to DataFrame
-user_summary_df = pd.DataFrame(user_summaries)
+        print(f"Total comments: {num_comments_total}")
+        print(f"Total submissions: {num_submissions_total}")
+        print(f"Total users: {len(user_summary_df)}")
 
-# Generate output file name with dataset sizes
-output_file = f"{folder}/user_summary_{num_comments_total}comments_{num_submissions_total}posts_{len(users_set)}users.tsv"
+        # Generate output file name with dataset sizes
+        output_file = f"{folder}/user_summary_{num_comments_total}comments_{num_submissions_total}posts_{len(user_summary_df)}users.tsv"
 
-# Export to TSV
-user_summary_df.to_csv(output_file, sep='\t', index=False)
+        # Export to TSV
+        with metrics.phase("write"):
+            user_summary_df.to_csv(output_file, sep='\t', index=False)
 
-print(f"User summary saved to {output_file}")
+        print(f"User summary saved to {output_file}")
+
+if __name__ == "__main__":
+    main()